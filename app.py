@@ -1,5 +1,7 @@
 import streamlit as st
-from utils import get_openai_response
+from utils import get_openai_response, streamlit_renderer, format_chat_stats
+from chat_history import ConversationHistory
+from instrumentation import render_performance_panel
 
 st.set_page_config(page_title="GenAI Chatbot", page_icon="🤖")
 st.title("🧠 Generative AI Chatbot")
@@ -9,6 +11,8 @@ if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 if "input_key" not in st.session_state:
     st.session_state.input_key = 0
+if "history_manager" not in st.session_state:
+    st.session_state.history_manager = ConversationHistory()
 
 # Display chat history first
 if st.session_state.chat_history:
@@ -20,21 +24,38 @@ if st.session_state.chat_history:
         else:
             with st.chat_message("assistant"):
                 st.write(message['content'])
+    stats_caption = format_chat_stats(st.session_state.get("last_chat_stats"))
+    if stats_caption:
+        st.caption(stats_caption)
+    history_manager = st.session_state.history_manager
+    if history_manager.compacted_messages:
+        st.caption(f"🧾 {history_manager.compacted_messages} earlier messages summarized, "
+                   f"{history_manager.total_tokens:,} tokens of context sent per turn")
 else:
     st.info("👋 Welcome! Start a conversation by typing a message below.")
 
+render_performance_panel()
+
 # Chat interface with form to handle submission properly
 with st.form(key="chat_form", clear_on_submit=True):
     user_input = st.text_input("💭 Type your message here:", placeholder="Ask me anything...", key=f"input_{st.session_state.input_key}")
     submit_button = st.form_submit_button("Send 🚀")
 
 if submit_button and user_input and user_input.strip():
-    with st.spinner("🤔 Thinking..."):
-        try:
-            response, updated_history = get_openai_response(user_input, st.session_state.chat_history)
-            st.session_state.chat_history = updated_history
-            st.session_state.input_key += 1  # Change the key to clear the input
-            st.rerun()  # Refresh the page to show the new messages
-        except Exception as e:
-            st.error(f"❌ Error: {str(e)}")
-            st.error("Please check your OpenAI API key and internet connection.")
\ No newline at end of file
+    with st.chat_message("user"):
+        st.write(user_input)
+    try:
+        # Stream the reply into the chat as it is generated
+        with st.chat_message("assistant"):
+            response, updated_history = get_openai_response(
+                user_input,
+                st.session_state.chat_history,
+                render=streamlit_renderer(),
+                history_manager=st.session_state.history_manager
+            )
+        st.session_state.chat_history = updated_history
+        st.session_state.input_key += 1  # Change the key to clear the input
+        st.rerun()  # Refresh the page to show the new messages
+    except Exception as e:
+        st.error(f"❌ Error: {str(e)}")
+        st.error("Please check your OpenAI API key and internet connection.")
\ No newline at end of file
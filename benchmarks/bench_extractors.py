@@ -0,0 +1,102 @@
+"""Measure text extraction throughput of each PDF backend.
+
+Generates a corpus of synthetic PDFs (or uses the PDFs in --pdf-dir) and
+extracts every page with each installed backend in pdf_ingest, reporting
+pages/s and MB/s per document kind, and which backend "auto" would pick.
+
+    python benchmarks/bench_extractors.py
+    python benchmarks/bench_extractors.py --pdf-dir ~/papers --repeat 1
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from pdf_ingest import available_extractors, extract_page_range, measure_extractor, open_pdf
+
+# name: (pages, words per page, KB of image padding per page)
+CORPUS = {
+    'short': (20, 300, 0),
+    'text-heavy': (200, 1200, 0),
+    'long': (1000, 250, 0),
+    'scan-sized': (100, 200, 300),
+}
+
+
+def build_corpus(scale: float) -> dict:
+    """Map document kind to synthetic PDF bytes"""
+    from synthetic_pdf import make_pdf
+
+    return {
+        name: make_pdf(max(1, int(pages * scale)), words, padding_kb * 1024, seed=i)
+        for i, (name, (pages, words, padding_kb)) in enumerate(CORPUS.items())
+    }
+
+
+def load_corpus(pdf_dir: str) -> dict:
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(pdf_dir, "*.pdf"))):
+        with open(path, 'rb') as f:
+            corpus[os.path.basename(path)] = f.read()
+    return corpus
+
+
+def time_extraction(extractor: str, pdf_bytes: bytes, repeat: int) -> tuple:
+    """(pages, best seconds) to open the PDF and extract every page"""
+    best = None
+    pages = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with open_pdf(pdf_bytes, extractor) as reader:
+            pages = len(reader.pages)
+        extract_page_range(pdf_bytes, 0, pages, extractor)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return pages, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pdf-dir", help="Benchmark these PDFs instead of the synthetic corpus")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply the synthetic page counts")
+    parser.add_argument("--repeat", type=int, default=2, help="Runs per document, the best is reported")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.pdf_dir) if args.pdf_dir else build_corpus(args.scale)
+    if not corpus:
+        parser.error(f"no PDFs found in {args.pdf_dir}")
+    extractors = available_extractors()
+
+    print(f"{'document':<16}{'pages':>7}{'MB':>8}" + "".join(f"{name + ' p/s':>14}{'MB/s':>8}" for name in extractors))
+    totals = {name: [0, 0.0, 0] for name in extractors}  # pages, seconds, bytes
+    for name, pdf_bytes in corpus.items():
+        size_mb = len(pdf_bytes) / 1024 / 1024
+        row = ""
+        pages = 0
+        for extractor in extractors:
+            pages, seconds = time_extraction(extractor, pdf_bytes, args.repeat)
+            totals[extractor][0] += pages
+            totals[extractor][1] += seconds
+            totals[extractor][2] += len(pdf_bytes)
+            row += f"{pages / seconds:>14.0f}{size_mb / seconds:>8.1f}"
+        print(f"{name:<16}{pages:>7}{size_mb:>8.1f}" + row)
+
+    row = ""
+    for extractor in extractors:
+        pages, seconds, size = totals[extractor]
+        row += f"{pages / seconds:>14.0f}{size / 1024 / 1024 / seconds:>8.1f}"
+    print(f"{'overall':<16}{'':>7}{'':>8}" + row)
+
+    # What "auto" measures: the first CALIBRATION_PAGES pages of the first document
+    first = next(iter(corpus.values()))
+    rates = {extractor: measure_extractor(extractor, first) for extractor in extractors}
+    print("auto calibration: " + ", ".join(f"{name} {rate:.0f} pages/s" for name, rate in rates.items())
+          + f" -> {max(rates, key=rates.get)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Compare peak memory of in-memory and spooled PDF ingestion.
+
+Each mode runs in a fresh interpreter that holds a synthetic PDF as an
+in-memory upload (as Streamlit does), then hashes and extracts it:
+
+  bytes    the upload's bytes are hashed in one piece and handed to every
+           extraction task (pickled to each worker process)
+  spooled  the upload is hashed block by block, spooled to a temporary file
+           and workers memory-map it (hash_upload / upload_source)
+
+Reports the parent's peak RSS above its baseline, of which memory-mapped
+file pages are shared page cache rather than copies, its peak anonymous
+(heap) memory above baseline, the peak of Python allocations, the largest
+worker RSS and the wall time.
+
+    python benchmarks/bench_ingest_memory.py --pages 400 --padding-kb 500
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ("bytes", "spooled")
+
+
+def rss_kb(field: str = "VmRSS") -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class AnonymousPeakSampler:
+    """Samples RssAnon on a thread; mapped file pages are excluded, unlike VmHWM"""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.peak = rss_kb("RssAnon")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_kb("RssAnon"))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def reset_peak_rss() -> bool:
+    """Reset VmHWM so it measures from now on (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def run_child(mode: str, pdf_path: str, pages_per_task: int, workers: int) -> dict:
+    import pdf_ingest
+    from pdf_ingest import hash_upload, ingest_pdfs, release_source, upload_source
+
+    # Fork workers directly so RUSAGE_CHILDREN sees them (fork server children are not ours);
+    # safe here, the only other thread is the RSS sampler, which holds no lock the workers need
+    pdf_ingest.POOL_START_METHOD = "fork"
+
+    with open(pdf_path, 'rb') as f:
+        upload = io.BytesIO(f.read())
+    baseline = rss_kb()
+    anonymous_baseline = rss_kb("RssAnon")
+    peak_reset = reset_peak_rss()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with AnonymousPeakSampler() as sampler:
+        if mode == "bytes":
+            pdf_bytes = upload.getvalue()
+            file_hash = hashlib.md5(pdf_bytes).hexdigest()
+            source = pdf_bytes
+        else:
+            file_hash = hash_upload(upload)
+            source = upload_source(upload, spool_threshold=0)
+        try:
+            result = ingest_pdfs([("bench.pdf", source, file_hash)], max_workers=workers,
+                                 pages_per_task=pages_per_task)[0]
+        finally:
+            release_source(source)
+    elapsed = time.perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    peak = rss_kb("VmHWM") if peak_reset else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'mode': mode,
+        'pages': len(result['pages']),
+        'errors': len(result['errors']),
+        'seconds': elapsed,
+        'parent_peak_mb': max(peak - baseline, 0) / 1024,
+        'anonymous_peak_mb': max(sampler.peak - anonymous_baseline, 0) / 1024,
+        'python_peak_mb': python_peak / 1024 / 1024,
+        'worker_peak_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--padding-kb", type=int, default=500, help="Image data per page, makes the file scan-sized")
+    parser.add_argument("--pages-per-task", type=int, default=25)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pdf", help="Use an existing PDF instead of generating one")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.pdf, args.pages_per_task, args.workers)))
+        return
+
+    pdf_path = args.pdf
+    if not pdf_path:
+        from synthetic_pdf import make_pdf
+
+        fd, pdf_path = tempfile.mkstemp(suffix=".pdf")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(make_pdf(args.pages, padding_bytes=args.padding_kb * 1024))
+    size_mb = os.path.getsize(pdf_path) / 1024 / 1024
+
+    try:
+        results = []
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode, "--pdf", pdf_path,
+                 "--pages-per-task", str(args.pages_per_task), "--workers", str(args.workers)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        if not args.pdf:
+            os.remove(pdf_path)
+
+    print(f"{size_mb:.0f} MB PDF, {results[0]['pages']} pages, {args.workers} workers, "
+          f"{args.pages_per_task} pages per task")
+    print(f"{'mode':<10}{'parent MB':>11}{'heap MB':>9}{'python MB':>11}{'worker MB':>11}{'seconds':>9}")
+    for result in results:
+        print(f"{result['mode']:<10}{result['parent_peak_mb']:>11.0f}{result['anonymous_peak_mb']:>9.0f}"
+              f"{result['python_peak_mb']:>11.0f}{result['worker_peak_mb']:>11.0f}{result['seconds']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Benchmark the OpenAI-backed entry points against the local stub server.
+
+Drives utils.get_openai_response, get_role_response, get_pdf_based_response,
+analyze_medical_image and generate_disease_progression_frames through a
+stub server (started in-process, or an existing one via --base-url). Reports
+p50/p95 latency, throughput and memory for each. Runs fully offline: the RAG
+index uses a hashed bag-of-words embedder instead of sentence-transformers,
+and token counts use a word-level stand-in for tiktoken, whose encodings are
+downloaded on first use (--tiktoken uses them when they are cached).
+
+    python benchmarks/bench_openai_paths.py
+    python benchmarks/bench_openai_paths.py --iterations 50 --concurrency 8 --error-rate 0.1
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(REPO_ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from stub_server import add_config_arguments, config_from_args, start_stub_server
+
+SCENARIOS = ("chat", "role", "pdf", "medical", "frames")
+
+EMBEDDING_DIM = 384
+
+
+def hashed_embeddings(texts):
+    """Offline stand-in for the sentence-transformers embedder"""
+    vectors = np.zeros((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in re.findall(r"\w+", text.lower()):
+            vectors[row, int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % EMBEDDING_DIM] += 1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class WordEncoding:
+    """Offline stand-in for a tiktoken encoding: words and punctuation marks are tokens"""
+
+    def encode(self, text):
+        return re.findall(r"\w+|[^\w\s]", text)
+
+
+def load_page(name: str):
+    """Import a Streamlit page as a module (its UI code runs in bare mode)"""
+    spec = importlib.util.spec_from_file_location(f"bench_page_{name}", os.path.join(REPO_ROOT, "pages", f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_scenarios(api_key: str) -> dict:
+    """Map scenario name to a function running one call"""
+    import utils
+    from pdf_ingest import make_page_record
+    from retrieval import RetrievalIndex
+
+    role_based = load_page("role_based")
+    rag = load_page("rag")
+    medical = load_page("medical_analyser")
+    image_to_video = load_page("image_to_video")
+
+    pdf_index = RetrievalIndex(embed_fn=hashed_embeddings)
+    pages = [
+        make_page_record(page, f"Section {page}. " + " ".join(
+            f"finding {page}-{i} describes tissue response, dosage and follow-up interval {i}" for i in range(60)
+        ))
+        for page in range(1, 41)
+    ]
+    pdf_index.add_document("bench-doc", "bench.pdf", pages)
+
+    xray = Image.fromarray(
+        np.random.default_rng(0).integers(0, 255, (1536, 1536), dtype=np.uint8), mode="L"
+    )
+    disease_info = {
+        'condition': "Diabetic Retinopathy",
+        'location': "Retina",
+        'visual_characteristics': "microaneurysms, hemorrhages and neovascularization",
+        'demographics': "Adults with long-standing diabetes"
+    }
+
+    def check_frames(result):
+        if len(result) != 5:
+            raise RuntimeError(f"Expected 5 frames, got {len(result)}")
+
+    def check_reply(result):
+        # get_pdf_based_response reports failures as its reply instead of raising
+        reply, _ = result
+        if not reply or reply.startswith("Error getting response"):
+            raise RuntimeError(reply or "Empty reply")
+
+    def analyze(i):
+        report = medical.analyze_medical_image(xray, "xray_analysis", api_key)
+        if not report:
+            raise RuntimeError("Empty report")
+
+    return {
+        'chat': lambda i: utils.get_openai_response(f"Question {i}: what is retrieval augmented generation?"),
+        'role': lambda i: role_based.get_role_response(f"Question {i}: how do I start running?", [], "Fitness Coach"),
+        'pdf': lambda i: check_reply(rag.get_pdf_based_response(
+            f"What follow-up interval is described in section {i % 40 + 1}?", pdf_index
+        )),
+        'medical': analyze,
+        'frames': lambda i: check_frames(image_to_video.generate_disease_progression_frames(disease_info, api_key)),
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(call, iterations: int, concurrency: int) -> dict:
+    """Run call(i) iterations times on concurrency threads and summarize latencies"""
+    latencies = []
+    errors = []
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            call(i)
+        except Exception as e:
+            errors.append(str(e))
+            return None
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency in executor.map(timed, range(iterations)):
+            if latency is not None:
+                latencies.append(latency)
+    wall = time.perf_counter() - start
+
+    return {
+        'calls': iterations,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'p50': percentile(latencies, 0.5) if latencies else None,
+        'p95': percentile(latencies, 0.95) if latencies else None,
+        'mean': statistics.fmean(latencies) if latencies else None,
+        'throughput': len(latencies) / wall if wall else 0.0,
+        'wall': wall
+    }
+
+
+def measure_memory(call, iterations: int) -> float:
+    """Peak Python allocations (MB) over a few sequential calls"""
+    tracemalloc.start()
+    try:
+        for i in range(iterations):
+            try:
+                call(i)
+            except Exception:
+                pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--memory-iterations", type=int, default=3,
+                        help="Sequential calls traced for peak memory (0 to skip)")
+    parser.add_argument("--base-url", help="Use a running stub (or other compatible server) instead of starting one")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--tiktoken", action="store_true",
+                        help="Count tokens with tiktoken (its encoding files must be cached) instead of the stand-in")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    server = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        server = start_stub_server(config_from_args(args))
+        base_url = server.base_url
+    api_key = "stub-key"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = api_key
+
+    # Pages write their caches relative to the working directory
+    work_dir = tempfile.mkdtemp(prefix="bench_openai_")
+    os.chdir(work_dir)
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    if not args.tiktoken:
+        import chat_history
+
+        # Prompt budgeting counts tokens on every PDF question
+        chat_history.get_encoding = lambda model: WordEncoding()
+    scenarios = build_scenarios(api_key)
+    results = {}
+    for name in args.scenarios or SCENARIOS:
+        call = scenarios[name]
+        call(-1)  # Warm up connections and lazy imports
+        result = run_scenario(call, args.iterations, args.concurrency)
+        if args.memory_iterations:
+            result['peak_alloc_mb'] = measure_memory(call, args.memory_iterations)
+        results[name] = result
+
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if args.json:
+        print(json.dumps({'base_url': base_url, 'results': results, 'max_rss_mb': max_rss_mb,
+                          'stub_counters': server.counters if server else None}, indent=2))
+        return
+
+    print(f"{args.iterations} calls per scenario, concurrency {args.concurrency}, against {base_url}")
+    print(f"{'scenario':<10}{'p50 ms':>10}{'p95 ms':>10}{'calls/s':>10}{'errors':>8}{'peak MB':>10}")
+    for name, result in results.items():
+        p50 = f"{result['p50'] * 1000:.0f}" if result['p50'] is not None else "-"
+        p95 = f"{result['p95'] * 1000:.0f}" if result['p95'] is not None else "-"
+        peak = f"{result['peak_alloc_mb']:.1f}" if 'peak_alloc_mb' in result else "-"
+        print(f"{name:<10}{p50:>10}{p95:>10}{result['throughput']:>10.1f}{result['errors']:>8}{peak:>10}")
+        if result['first_error']:
+            print(f"{'':<10}first error: {result['first_error'][:120]}")
+    print(f"max RSS {max_rss_mb:.0f} MB")
+    if server:
+        print(f"stub served {server.counters['requests']} requests, injected {server.counters['errors']} errors")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
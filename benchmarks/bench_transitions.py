@@ -0,0 +1,90 @@
+"""Benchmark the progression transition engine.
+
+Renders a 5-stage, 3-second-per-stage, 30 fps clip of 1024x1024 frames for
+each transition type and reports frames per second. Pass --encode to also
+time writing the clip with OpenCV.
+
+    python benchmarks/bench_transitions.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from progression_video import encode_progression_video, iter_progression_frames
+from transitions import TRANSITIONS, TransitionRenderer
+
+
+def make_stage_images(stages: int, side: int, seed: int = 0) -> list:
+    """Smooth synthetic stage images with a blob that grows from stage to stage"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:side, 0:side].astype(np.float32) / side
+    images = []
+    for stage in range(stages):
+        radius = 0.1 + 0.06 * stage
+        blob = np.exp(-((x - 0.5) ** 2 + (y - 0.5) ** 2) / (2 * radius ** 2))
+        noise = rng.normal(0, 8, (side, side, 1))
+        base = np.stack([x * 120 + 60, y * 80 + 90, np.full_like(x, 140)], axis=-1)
+        image = base + blob[..., None] * np.array([90, -40, -60]) + noise
+        images.append(np.clip(image, 0, 255).astype(np.uint8))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", type=int, default=5)
+    parser.add_argument("--stage-seconds", type=float, default=3.0)
+    parser.add_argument("--transition-seconds", type=float, default=1.0)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--side", type=int, default=1024)
+    parser.add_argument("--encode", action="store_true", help="Also time encoding the clip to MP4")
+    args = parser.parse_args()
+
+    stage_images = make_stage_images(args.stages, args.side)
+    print(f"{args.stages} stages, {args.stage_seconds}s each, {args.fps} fps, "
+          f"{args.side}x{args.side}, {args.transition_seconds}s transitions")
+
+    for transition in TRANSITIONS:
+        renderer = TransitionRenderer()
+        start = time.perf_counter()
+        frames = 0
+        transition_time = 0.0
+        checksum = 0
+        for frame in iter_progression_frames(stage_images, args.fps, args.stage_seconds,
+                                             args.transition_seconds, transition, renderer):
+            # Touch every frame so lazy work can't be skipped
+            checksum += int(frame[0, 0, 0])
+            frames += 1
+        elapsed = time.perf_counter() - start
+
+        # Transition frames alone, which is where the work is
+        start = time.perf_counter()
+        transition_frames = round(args.transition_seconds * args.fps)
+        for a, b in zip(stage_images, stage_images[1:]):
+            for frame in renderer.render(transition, a, b, transition_frames):
+                checksum += int(frame[0, 0, 0])
+        transition_time = time.perf_counter() - start
+        rendered = transition_frames * (args.stages - 1)
+
+        print(f"{transition:>10}: clip {frames} frames in {elapsed:.2f}s ({frames / elapsed:.0f} fps), "
+              f"transitions {rendered / transition_time:.0f} fps")
+
+        if args.encode:
+            pil_frames = [{'stage_number': i + 1, 'image': Image.fromarray(image[..., ::-1])}
+                          for i, image in enumerate(stage_images)]
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                video = encode_progression_video(
+                    pil_frames, os.path.join(tmp_dir, "bench.mp4"), args.stage_seconds, args.fps,
+                    args.transition_seconds, transition=transition
+                )
+            print(f"{'':>10}  encoded with {video['codec']} in {video['encode_time']:.2f}s "
+                  f"({video['frames_written'] / video['encode_time']:.0f} fps)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Profile the cold start of each Streamlit page.
+
+Every page runs in a fresh interpreter under ``python -X importtime``, in
+Streamlit bare mode, so each measurement is a true cold start. For each page
+this reports the time to first paint (the first Streamlit element call), the
+time to finish the script, and the slowest top-level imports.
+
+    python benchmarks/profile_startup.py
+    python benchmarks/profile_startup.py pages/rag.py --top 15
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Executed in the child interpreter: time the page run and its first element call
+RUNNER = r"""
+import json, os, runpy, sys, time
+sys.stderr.write("PROFILE-START\n")
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+os.chdir({root!r})
+
+import streamlit as st
+streamlit_ready = time.perf_counter()
+first_paint = []
+
+def mark_first_paint(fn):
+    def wrapper(*args, **kwargs):
+        if not first_paint:
+            first_paint.append(time.perf_counter())
+        return fn(*args, **kwargs)
+    return wrapper
+
+for name in ("set_page_config", "title", "header", "markdown", "write"):
+    setattr(st, name, mark_first_paint(getattr(st, name)))
+
+runpy.run_path({page!r}, run_name="__main__")
+done = time.perf_counter()
+print("PROFILE " + json.dumps({{
+    "streamlit_import": streamlit_ready - start,
+    "first_paint": (first_paint[0] - start) if first_paint else None,
+    "script": done - start
+}}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Cumulative microseconds per top-level package, from -X importtime output"""
+    totals = defaultdict(int)
+    # Imports logged before the marker are interpreter startup, not the page
+    _, _, stderr = stderr.rpartition("PROFILE-START\n")
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, module = match.groups()
+        # Only imports made directly by the runner or the page (depth 1)
+        if len(indent) == 1:
+            totals[module.split(".")[0]] += int(cumulative)
+    return totals
+
+
+def profile_page(page: str) -> dict:
+    """Run one page cold and return its timings and per-package import times"""
+    code = RUNNER.format(root=REPO_ROOT, page=os.path.join(REPO_ROOT, page))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=REPO_ROOT
+    )
+    timings = None
+    for line in result.stdout.splitlines():
+        if line.startswith("PROFILE "):
+            timings = json.loads(line[len("PROFILE "):])
+    if timings is None:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"{page} failed to run:\n" + "\n".join(errors[-15:]))
+    timings['imports'] = parse_importtime(result.stderr)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pages", nargs="*", help="Page scripts relative to the repo root (default: all)")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list per page")
+    parser.add_argument("--json", action="store_true", help="Print raw results as JSON")
+    args = parser.parse_args()
+
+    pages = args.pages or ["app.py"] + sorted(
+        os.path.relpath(path, REPO_ROOT) for path in glob.glob(os.path.join(REPO_ROOT, "pages", "*.py"))
+    )
+
+    results = {}
+    for page in pages:
+        try:
+            results[page] = profile_page(page)
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for page, timings in results.items():
+        first_paint = timings['first_paint']
+        print(f"\n{page}")
+        print(f"  streamlit import {timings['streamlit_import'] * 1000:7.0f} ms")
+        print(f"  first paint      {first_paint * 1000:7.0f} ms" if first_paint is not None else "  first paint          n/a")
+        print(f"  script done      {timings['script'] * 1000:7.0f} ms")
+        slowest = sorted(timings['imports'].items(), key=lambda item: item[1], reverse=True)[:args.top]
+        for module, micros in slowest:
+            print(f"    {module:<28} {micros / 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
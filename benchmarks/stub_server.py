@@ -0,0 +1,281 @@
+"""Local OpenAI-compatible stub server for offline benchmarks.
+
+Implements ``POST /v1/chat/completions`` (streaming and non-streaming) and
+``POST /v1/images/generations`` (URL and b64_json responses, with the PNGs
+served from ``GET /images/<id>.png``). Latency, token rate and error
+injection are configurable, so the app can be benchmarked without network
+access. Point the OpenAI client at it with ``OPENAI_BASE_URL``:
+
+    python benchmarks/stub_server.py --port 8765 --latency 0.2 --tokens-per-second 200
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub streamlit run app.py
+"""
+import argparse
+import base64
+import hashlib
+import io
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from PIL import Image
+
+WORDS = (
+    "the patient presents with findings consistent with early stage changes that should be "
+    "reviewed by a qualified clinician alongside history examination and further imaging"
+).split()
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.1            # Seconds before the first token / image
+    jitter: float = 0.0             # Uniform extra latency in [0, jitter]
+    tokens_per_second: float = 100.0
+    reply_tokens: int = 60
+    image_latency: float = 0.5
+    error_rate: float = 0.0         # Fraction of requests that fail
+    error_status: int = 429
+    retry_after: float = 0.05       # Retry-After sent with injected 429s
+    seed: Optional[int] = None
+
+
+@lru_cache(maxsize=64)
+def render_png(size: str, color: tuple) -> bytes:
+    """A solid-color PNG of the requested WxH size"""
+    width, height = (int(side) for side in size.split("x"))
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def prompt_color(prompt: str) -> tuple:
+    return tuple(hashlib.md5(prompt.encode("utf-8")).digest()[:3])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "OpenAIStub/1.0"
+
+    @property
+    def config(self) -> StubConfig:
+        return self.server.config
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _wait(self, base: float):
+        extra = self.server.rng.uniform(0, self.config.jitter) if self.config.jitter else 0.0
+        time.sleep(base + extra)
+
+    def _inject_error(self) -> bool:
+        """Fail this request according to error_rate, returning True if it did"""
+        if not self.config.error_rate or self.server.rng.random() >= self.config.error_rate:
+            return False
+        self.server.count("errors")
+        status = self.config.error_status
+        headers = {"Retry-After": str(self.config.retry_after)} if status == 429 else {}
+        self._send_json(status, {"error": {"message": "Injected stub error", "type": "stub_error",
+                                           "code": str(status)}}, headers)
+        return True
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        self.server.count("requests")
+        try:
+            body = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+        if self._inject_error():
+            return
+        if path.endswith("/chat/completions"):
+            self._chat_completion(body)
+        elif path.endswith("/images/generations"):
+            self._image_generation(body)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown endpoint {path}"}})
+
+    def do_GET(self):
+        image = self.server.images.get(self.path.rsplit("/", 1)[-1])
+        if image is None:
+            self._send_json(404, {"error": {"message": "Unknown image"}})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(image)))
+        self.end_headers()
+        self.wfile.write(image)
+
+    def _chat_completion(self, body: dict):
+        model = body.get("model", "stub")
+        max_tokens = body.get("max_tokens") or self.config.reply_tokens
+        n_tokens = min(self.config.reply_tokens, max_tokens)
+        tokens = [WORDS[i % len(WORDS)] + " " for i in range(n_tokens)]
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": n_tokens,
+                 "total_tokens": prompt_tokens + n_tokens}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        token_delay = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second else 0.0
+
+        self._wait(self.config.latency)
+        if not body.get("stream"):
+            time.sleep(token_delay * n_tokens)
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            })
+
+        send_event(chunk({"role": "assistant", "content": ""}))
+        for token in tokens:
+            send_event(chunk({"content": token}))
+            if token_delay:
+                time.sleep(token_delay)
+        send_event(chunk({}, "stop"))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [], "usage": usage
+            }))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _image_generation(self, body: dict):
+        size = body.get("size", "1024x1024")
+        n = int(body.get("n", 1))
+        png = render_png(size, prompt_color(body.get("prompt", "")))
+        self._wait(self.config.image_latency)
+
+        data = []
+        for _ in range(n):
+            if body.get("response_format") == "b64_json":
+                data.append({"b64_json": base64.b64encode(png).decode("ascii")})
+            else:
+                image_id = f"{uuid.uuid4().hex}.png"
+                self.server.images[image_id] = png
+                host, port = self.server.server_address[:2]
+                data.append({"url": f"http://{host}:{port}/images/{image_id}"})
+        self._send_json(200, {"created": int(time.time()), "data": data})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, config: StubConfig, verbose: bool = False):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.verbose = verbose
+        self.rng = random.Random(config.seed)
+        # Generated images served by URL, kept for the lifetime of the server
+        self.images = {}
+        self.counters = {"requests": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients dropping pooled keep-alive connections is expected, not an error
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    def count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_stub_server(config: Optional[StubConfig] = None, host: str = "127.0.0.1", port: int = 0,
+                      verbose: bool = False) -> StubServer:
+    """Start a stub server on a background thread; port 0 picks a free port"""
+    server = StubServer((host, port), config or StubConfig(), verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = StubConfig()
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="Seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="Extra random latency, seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--reply-tokens", type=int, default=defaults.reply_tokens)
+    parser.add_argument("--image-latency", type=float, default=defaults.image_latency)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate,
+                        help="Fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        latency=args.latency, jitter=args.jitter, tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens, image_latency=args.image_latency, error_rate=args.error_rate,
+        error_status=args.error_status, retry_after=args.retry_after, seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), config_from_args(args), args.verbose)
+    print(f"OpenAI stub listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Generate synthetic text PDFs for ingestion benchmarks, without extra dependencies.
+
+Each page carries a few lines of Helvetica text. Optional padding attaches an
+uncompressed grayscale image to every page, so files can be made as large as
+scanned documents while text extraction stays cheap.
+
+    python benchmarks/synthetic_pdf.py out.pdf --pages 500 --padding-kb 400
+"""
+import argparse
+import random
+from typing import List
+
+WORDS = (
+    "patient dosage metformin follow-up interval tissue response clinical findings section "
+    "assessment diagnosis e11.9 hba1c review imaging contract clause liability schedule"
+).split()
+
+LINES_PER_PAGE = 40
+
+
+def page_text_lines(rng: random.Random, words_per_page: int) -> List[str]:
+    words = [rng.choice(WORDS) for _ in range(words_per_page)]
+    per_line = max(1, -(-words_per_page // LINES_PER_PAGE))
+    return [" ".join(words[i:i + per_line]) for i in range(0, len(words), per_line)]
+
+
+def make_pdf(pages: int = 100, words_per_page: int = 300, padding_bytes: int = 0, seed: int = 0) -> bytes:
+    """Return a PDF with the given page count; padding_bytes of image data are attached to each page"""
+    rng = random.Random(seed)
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    def stream(header: str, data: bytes) -> bytes:
+        return f"<< {header} /Length {len(data)} >>\nstream\n".encode("ascii") + data + b"\nendstream"
+
+    catalog = add(b"")
+    pages_id = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for page_number in range(1, pages + 1):
+        lines = [f"Page {page_number}"] + page_text_lines(rng, words_per_page)
+        text = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        content = add(stream("", text.encode("ascii")))
+        resources = f"/Font << /F1 {font} 0 R >>"
+        if padding_bytes:
+            side = max(1, int(padding_bytes ** 0.5))
+            image = add(stream(f"/Type /XObject /Subtype /Image /Width {side} /Height {side} "
+                               f"/ColorSpace /DeviceGray /BitsPerComponent 8", rng.randbytes(side * side)))
+            resources += f" /XObject << /Im1 {image} 0 R >>"
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << {resources} >> /Contents {content} 0 R >>".encode("ascii")
+        ))
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode("ascii")
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("ascii")
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode("ascii") + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+    out += b"".join(f"{offset:010d} 00000 n \n".encode("ascii") for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii")
+    return bytes(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output")
+    parser.add_argument("--pages", type=int, default=100)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--padding-kb", type=int, default=0, help="Image data attached to each page")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = make_pdf(args.pages, args.words_per_page, args.padding_kb * 1024, args.seed)
+    with open(args.output, 'wb') as f:
+        f.write(data)
+    print(f"Wrote {args.output}: {args.pages} pages, {len(data) / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Bump when tokenization or the shard layout changes; stored shards from other versions are rebuilt
+BM25_VERSION = 1
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words with internal dots, dashes or slashes stay whole ("e11.9", "icd-10", "42/2019")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+# Longer tokens (URLs, hashes, base64) are dropped, they would bloat the term array
+MAX_TOKEN_LENGTH = 40
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms; compound codes are kept whole and also split into their parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if len(token) > MAX_TOKEN_LENGTH:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[.\-/]", token) if part)
+    return tokens
+
+
+class BM25Shard:
+    """Postings of one document in compressed sparse row form.
+
+    Row i of the CSR arrays holds the chunks containing terms[i]: chunk ids
+    (relative to the document) in chunk_ids[indptr[i]:indptr[i + 1]] and the
+    term's frequency in each of them in the same slice of tfs.
+    """
+
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, chunk_ids: np.ndarray, tfs: np.ndarray,
+                 lengths: np.ndarray):
+        self.terms = terms
+        self.indptr = indptr
+        self.chunk_ids = chunk_ids
+        self.tfs = tfs
+        self.lengths = lengths
+        self.rows = {term: row for row, term in enumerate(terms.tolist())}
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @classmethod
+    def build(cls, texts: List[str]) -> "BM25Shard":
+        """Tokenize chunk texts and build their postings"""
+        vocabulary: Dict[str, int] = {}
+        term_ids, chunk_ids, tfs = [], [], []
+        lengths = np.zeros(len(texts), dtype=np.int32)
+        for chunk_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[chunk_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                chunk_ids.append(chunk_id)
+                tfs.append(tf)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        counts = np.bincount(term_ids, minlength=len(vocabulary))
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(
+            # Dicts keep insertion order, which is term id order
+            np.array(list(vocabulary), dtype=str),
+            indptr,
+            np.asarray(chunk_ids, dtype=np.int32)[order],
+            np.asarray(tfs, dtype=np.float32)[order],
+            lengths
+        )
+
+    def postings(self, term: str) -> Optional[tuple]:
+        """(chunk_ids, tfs) for a term, or None when the document lacks it"""
+        row = self.rows.get(term)
+        if row is None:
+            return None
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.chunk_ids[start:end], self.tfs[start:end]
+
+    def save(self, path: str):
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, version=np.int32(BM25_VERSION), terms=self.terms, indptr=self.indptr,
+                 chunk_ids=self.chunk_ids, tfs=self.tfs, lengths=self.lengths)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Shard"]:
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['version']) != BM25_VERSION:
+                    return None
+                return cls(data['terms'], data['indptr'], data['chunk_ids'], data['tfs'], data['lengths'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+class BM25Index:
+    """BM25 over the chunks of many documents, one BM25Shard per document.
+
+    Shards are appended in the same order as the dense index's chunks, so
+    chunk ids line up. Document frequencies and the average chunk length are
+    global across shards.
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.shards: List[tuple] = []  # (chunk id offset, shard)
+        self.lengths = np.zeros(0, dtype=np.int32)
+        self._norms = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, shard: BM25Shard):
+        self.shards.append((len(self.lengths), shard))
+        self.lengths = np.concatenate([self.lengths, shard.lengths])
+        self._norms = None
+
+    def search(self, query: str, top_k: int, mask: Optional[np.ndarray] = None) -> List[tuple]:
+        """Return (chunk_id, score) pairs for the best top_k chunks, best first.
+
+        mask, a boolean array over chunk ids, excludes the chunks that are False.
+        """
+        n_chunks = len(self.lengths)
+        if not n_chunks:
+            return []
+        if self._norms is None:
+            # Length normalisation depends only on the corpus, so it is computed once per change
+            average_length = max(float(self.lengths.mean()), 1.0)
+            self._norms = (self.k1 * (1 - self.b + self.b * self.lengths / average_length)).astype(np.float32)
+        norms = self._norms
+        scores = np.zeros(n_chunks, dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            ids, tfs = [], []
+            for offset, shard in self.shards:
+                postings = shard.postings(term)
+                if postings is not None:
+                    ids.append(postings[0] + offset)
+                    tfs.append(postings[1])
+            if not ids:
+                continue
+            ids = np.concatenate(ids)
+            tfs = np.concatenate(tfs)
+            df = len(ids)
+            idf = np.log(1.0 + (n_chunks - df + 0.5) / (df + 0.5))
+            # Each chunk appears once per term, so plain fancy-index addition is safe
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norms[ids])
+        if mask is not None:
+            scores[~mask] = 0
+
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return []
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(scores[candidates], -top_k)[-top_k:]]
+        candidates = candidates[np.argsort(scores[candidates])[::-1]]
+        return [(int(chunk_id), float(scores[chunk_id])) for chunk_id in candidates]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[tuple]:
+    """Fuse ranked lists of ids into (id, score) pairs, best first, scoring sum(1 / (k + rank))"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda pair: pair[1], reverse=True)
@@ -0,0 +1,132 @@
+import os
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from utils import complete_chat
+
+# Tokens of conversation (summary + recent messages) sent with each request
+DEFAULT_HISTORY_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "3000"))
+
+# Model and size of the rolling summary of compacted turns
+SUMMARY_MODEL = "gpt-3.5-turbo"
+SUMMARY_MAX_TOKENS = 300
+
+# Once over budget, compact down to this fraction of it so summaries run every few turns, not every turn
+COMPACTION_TARGET = 0.6
+
+# Fixed per-message overhead of the chat format (role and separators)
+TOKENS_PER_MESSAGE = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Return the tiktoken encoding for a model, falling back to cl100k_base"""
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    return len(get_encoding(model).encode(text))
+
+
+def count_message_tokens(message: Dict, model: str = "gpt-4") -> int:
+    return count_tokens(message["content"], model) + TOKENS_PER_MESSAGE
+
+
+def summarize_messages(summary: str, messages: List[Dict]) -> str:
+    """Fold messages that left the window into the rolling conversation summary"""
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    prompt = f"""Update the summary of an ongoing conversation with the new messages below.
+Keep names, numbers, decisions and open questions. Reply with the updated summary only.
+
+CURRENT SUMMARY:
+{summary or "(empty)"}
+
+NEW MESSAGES:
+{transcript}"""
+    reply, _ = complete_chat(
+        [{"role": "user", "content": prompt}],
+        model=SUMMARY_MODEL,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        temperature=0.2
+    )
+    return reply.strip()
+
+
+class ConversationHistory:
+    """Sliding window of chat messages kept under a token budget.
+
+    Every message is tokenized once when it is appended and its count is
+    cached, so checking the budget is O(1) per turn. Messages that fall out of
+    the window are compacted into a rolling summary sent ahead of the window.
+    """
+
+    def __init__(self, budget_tokens: int = DEFAULT_HISTORY_BUDGET, model: str = "gpt-4",
+                 summarize: Optional[Callable[[str, List[Dict]], str]] = None):
+        self.budget_tokens = budget_tokens
+        self.model = model
+        self.summarize = summarize or summarize_messages
+        self.window = deque()
+        self.window_tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.compacted_messages = 0
+
+    def __len__(self):
+        return len(self.window)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.window_tokens + self.summary_tokens
+
+    def append(self, role: str, content: str):
+        message = {"role": role, "content": content}
+        tokens = count_message_tokens(message, self.model)
+        self.window.append((message, tokens))
+        self.window_tokens += tokens
+
+    def pop(self) -> Dict:
+        """Remove and return the newest message, e.g. a prompt whose request failed"""
+        message, tokens = self.window.pop()
+        self.window_tokens -= tokens
+        return message
+
+    def _compact(self):
+        """Move the oldest messages into the summary until the window fits the budget"""
+        # Room is kept for the summary so compaction cannot push us back over budget
+        limit = self.budget_tokens - SUMMARY_MAX_TOKENS - TOKENS_PER_MESSAGE
+        if self.window_tokens <= limit:
+            return
+
+        target = limit * COMPACTION_TARGET
+        evicted = []
+        remaining_tokens = self.window_tokens
+        # The newest message (the current prompt) always stays in the window
+        while remaining_tokens > target and len(evicted) < len(self.window) - 1:
+            message, tokens = self.window[len(evicted)]
+            remaining_tokens -= tokens
+            evicted.append(message)
+
+        if evicted:
+            # Messages leave the window only once they are in the summary, a failed summary loses nothing
+            self.summary = self.summarize(self.summary, evicted)
+            self.summary_tokens = count_message_tokens(self._summary_message(), self.model)
+            for _ in evicted:
+                self.window.popleft()
+            self.window_tokens = remaining_tokens
+            self.compacted_messages += len(evicted)
+
+    def _summary_message(self) -> Dict:
+        return {"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"}
+
+    def messages(self) -> List[Dict]:
+        """Messages to send with the next request: the summary, then the recent window"""
+        self._compact()
+        messages = [self._summary_message()] if self.summary else []
+        messages.extend(message for message, _ in self.window)
+        return messages
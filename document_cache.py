@@ -0,0 +1,234 @@
+import glob
+import gzip
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Callable, Dict, List, Optional
+
+# Bump when the on-disk layout of cache bodies changes
+CACHE_FORMAT_VERSION = 1
+
+# Disk budget for cached document bodies
+DEFAULT_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+# Page segments of documents whose extraction never finished are dropped after this long
+SEGMENT_MAX_AGE = 7 * 24 * 3600
+
+INDEX_COLUMNS = (
+    "file_hash", "filename", "byte_size", "source_size", "page_count", "word_count",
+    "char_count", "extractor_version", "extractor", "format_version", "created_at", "last_access"
+)
+
+
+class DocumentCache:
+    """Cache of extracted PDF page records.
+
+    Bodies are stored as gzip-compressed JSON (``<hash>.json.gz``) and listed in
+    a SQLite index, so lookups, listings and eviction never read a body. Entries
+    written by another extractor or cache format version are dropped, and the
+    least recently used entries are evicted once bodies exceed ``max_bytes``.
+
+    While a document is being extracted, finished page ranges are kept as
+    segments, so an interrupted extraction resumes where it stopped. They are
+    dropped once the whole document is stored.
+    """
+
+    def __init__(self, cache_dir: str, extractor_version: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.cache_dir = cache_dir
+        self.extractor_version = extractor_version
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.index_path = os.path.join(cache_dir, "index.sqlite")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    file_hash TEXT PRIMARY KEY,
+                    filename TEXT NOT NULL,
+                    byte_size INTEGER NOT NULL,
+                    source_size INTEGER,
+                    page_count INTEGER NOT NULL,
+                    word_count INTEGER NOT NULL,
+                    char_count INTEGER NOT NULL,
+                    extractor_version TEXT NOT NULL,
+                    extractor TEXT NOT NULL DEFAULT 'pypdf2',
+                    format_version INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_last_access ON documents (last_access)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS segments (
+                    file_hash TEXT NOT NULL,
+                    start_page INTEGER NOT NULL,
+                    end_page INTEGER NOT NULL,
+                    body BLOB NOT NULL,
+                    extractor_version TEXT NOT NULL,
+                    extractor TEXT NOT NULL DEFAULT 'pypdf2',
+                    format_version INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (file_hash, start_page)
+                )
+            """)
+            # Indexes created before extraction backends were recorded
+            for table in ("documents", "segments"):
+                columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+                if "extractor" not in columns:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN extractor TEXT NOT NULL DEFAULT 'pypdf2'")
+        self._drop_stale_entries()
+        self._drop_legacy_pickles()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _body_path(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{file_hash}.json.gz")
+
+    def _delete(self, conn: sqlite3.Connection, file_hashes: List[str]):
+        for file_hash in file_hashes:
+            conn.execute("DELETE FROM documents WHERE file_hash = ?", (file_hash,))
+            conn.execute("DELETE FROM segments WHERE file_hash = ?", (file_hash,))
+            body_path = self._body_path(file_hash)
+            if os.path.exists(body_path):
+                os.remove(body_path)
+            if self.on_evict:
+                self.on_evict(file_hash)
+
+    def _drop_stale_entries(self):
+        """Invalidate entries produced by a different extractor or cache format"""
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                "SELECT file_hash FROM documents WHERE extractor_version != ? OR format_version != ?",
+                (self.extractor_version, CACHE_FORMAT_VERSION)
+            ).fetchall()
+            self._delete(conn, [row["file_hash"] for row in rows])
+            conn.execute(
+                "DELETE FROM segments WHERE extractor_version != ? OR format_version != ? OR created_at < ?",
+                (self.extractor_version, CACHE_FORMAT_VERSION, time.time() - SEGMENT_MAX_AGE)
+            )
+
+    def _drop_legacy_pickles(self):
+        """Remove entries from the old one-pickle-per-document format"""
+        for path in glob.glob(os.path.join(self.cache_dir, "*.pkl")):
+            os.remove(path)
+
+    def lookup(self, file_hash: str) -> Optional[Dict]:
+        """Return the index entry for a document without reading its body"""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT * FROM documents WHERE file_hash = ?", (file_hash,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(self._body_path(file_hash)):
+                self._delete(conn, [file_hash])
+                return None
+            conn.execute("UPDATE documents SET last_access = ? WHERE file_hash = ?", (time.time(), file_hash))
+        return dict(row)
+
+    def load(self, file_hash: str) -> Optional[Dict]:
+        """Return {'filename', 'extractor', 'pages', 'stats'} for a cached document"""
+        entry = self.lookup(file_hash)
+        if entry is None:
+            return None
+        try:
+            with gzip.open(self._body_path(file_hash), 'rt', encoding='utf-8') as f:
+                pages = json.load(f)
+        except (OSError, ValueError):
+            self.remove(file_hash)
+            return None
+        return {
+            'filename': entry['filename'],
+            'extractor': entry['extractor'],
+            'pages': pages,
+            'stats': {
+                'pages': entry['page_count'],
+                'words': entry['word_count'],
+                'chars': entry['char_count']
+            }
+        }
+
+    def store(self, file_hash: str, filename: str, pages: List[Dict], stats: Dict,
+              source_size: Optional[int] = None, extractor: str = "pypdf2"):
+        """Write a document body and its index entry, then enforce the disk budget"""
+        body_path = self._body_path(file_hash)
+        tmp_path = f"{body_path}.{os.getpid()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(pages, f, separators=(',', ':'))
+        os.replace(tmp_path, body_path)
+
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO documents ({', '.join(INDEX_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(INDEX_COLUMNS))})",
+                (file_hash, filename, os.path.getsize(body_path), source_size, stats['pages'],
+                 stats['words'], stats['chars'], self.extractor_version, extractor, CACHE_FORMAT_VERSION, now, now)
+            )
+            conn.execute("DELETE FROM segments WHERE file_hash = ?", (file_hash,))
+        self.evict(keep=file_hash)
+
+    def store_segment(self, file_hash: str, start: int, end: int, page_results: List[tuple],
+                      extractor: str = "pypdf2"):
+        """Keep the (page_record, error) results of pages [start, end) of a document being extracted"""
+        body = gzip.compress(json.dumps(page_results, separators=(',', ':')).encode('utf-8'), compresslevel=1)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO segments (file_hash, start_page, end_page, body, extractor_version, "
+                "extractor, format_version, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, start, end, body, self.extractor_version, extractor, CACHE_FORMAT_VERSION, time.time())
+            )
+
+    def load_segments(self, file_hash: str, extractor: str = "pypdf2") -> List[tuple]:
+        """Return the (start, end, page_results) segments a backend stored for a document, by start page"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT start_page, end_page, body FROM segments WHERE file_hash = ? AND extractor = ? "
+                "AND extractor_version = ? AND format_version = ? ORDER BY start_page",
+                (file_hash, extractor, self.extractor_version, CACHE_FORMAT_VERSION)
+            ).fetchall()
+        segments = []
+        for row in rows:
+            try:
+                page_results = json.loads(gzip.decompress(row["body"]))
+            except (OSError, ValueError):
+                continue
+            segments.append((row["start_page"], row["end_page"], [tuple(result) for result in page_results]))
+        return segments
+
+    def remove(self, file_hash: str):
+        with closing(self._connect()) as conn, conn:
+            self._delete(conn, [file_hash])
+
+    def entries(self) -> List[Dict]:
+        """List index entries, most recently used first"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT * FROM documents ORDER BY last_access DESC").fetchall()
+        return [dict(row) for row in rows]
+
+    def total_bytes(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COALESCE(SUM(byte_size), 0) FROM documents").fetchone()[0]
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        evicted = []
+        with closing(self._connect()) as conn, conn:
+            total = conn.execute("SELECT COALESCE(SUM(byte_size), 0) FROM documents").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            rows = conn.execute("SELECT file_hash, byte_size FROM documents ORDER BY last_access ASC").fetchall()
+            for row in rows:
+                if total <= self.max_bytes:
+                    break
+                if row["file_hash"] == keep:
+                    continue
+                evicted.append(row["file_hash"])
+                total -= row["byte_size"]
+            self._delete(conn, evicted)
+        return len(evicted)
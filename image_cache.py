@@ -0,0 +1,217 @@
+import base64
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from functools import lru_cache
+from typing import List, Optional
+
+from PIL import Image
+
+from instrumentation import span
+
+DEFAULT_CACHE_DIR = "image_cache"
+
+# Disk budget for cached PNG files
+DEFAULT_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+# Decoded images kept in memory in front of the disk cache
+DEFAULT_MEMORY_BYTES = int(os.getenv("IMAGE_CACHE_MEMORY_MB", "64")) * 1024 * 1024
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def make_request_key(prompt: str, model: str, size: str, quality: str, style: str, n: int) -> str:
+    """Hash every parameter that determines what an image generation request returns"""
+    payload = json.dumps([prompt, model, size, quality, style, n], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def fetch_image_bytes(image_data, timeout: int = 120) -> bytes:
+    """PNG bytes for one item of ``images.generate(...).data``, from b64_json or its URL"""
+    if getattr(image_data, "b64_json", None):
+        content = base64.b64decode(image_data.b64_json)
+    else:
+        import requests
+
+        with span("image.download") as attributes:
+            response = requests.get(image_data.url, timeout=timeout)
+            response.raise_for_status()
+            content = response.content
+            attributes['bytes_in'] = len(content)
+
+    if content.startswith(PNG_SIGNATURE):
+        return content
+    # Anything else is re-encoded once, here, instead of on every display
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(content)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class GeneratedImageCache:
+    """Cache of generated images, addressed by request and by content.
+
+    PNG bytes are stored once per content hash (``<hash>.png``). A SQLite index
+    maps request keys (see make_request_key) to the ordered content hashes they
+    produced, so an identical request is answered without calling the API. An
+    in-memory LRU of image bytes sits in front of the disk, so reruns never
+    touch the network or re-encode. Least recently used images are evicted once
+    files exceed ``max_bytes``, together with the requests that reference them.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 memory_bytes: int = DEFAULT_MEMORY_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.index_path = os.path.join(cache_dir, "index.sqlite")
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    content_hash TEXT PRIMARY KEY,
+                    byte_size INTEGER NOT NULL,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS requests (
+                    request_key TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (request_key, position)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS images_last_access ON images (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS requests_content ON requests (content_hash)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    def _image_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{content_hash}.png")
+
+    def _remember(self, content_hash: str, data: bytes):
+        with self._lock:
+            if content_hash in self._memory:
+                self._memory.move_to_end(content_hash)
+                return
+            self._memory[content_hash] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _forget(self, content_hash: str):
+        with self._lock:
+            data = self._memory.pop(content_hash, None)
+            if data is not None:
+                self._memory_size -= len(data)
+
+    def lookup_request(self, request_key: str) -> Optional[List[str]]:
+        """Content hashes produced by an earlier identical request, or None"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT r.content_hash FROM requests r JOIN images i ON i.content_hash = r.content_hash "
+                "WHERE r.request_key = ? ORDER BY r.position",
+                (request_key,)
+            ).fetchall()
+            expected = conn.execute(
+                "SELECT COUNT(*) FROM requests WHERE request_key = ?", (request_key,)
+            ).fetchone()[0]
+        # A partially evicted request is a miss
+        if not rows or len(rows) != expected:
+            return None
+        return [row[0] for row in rows]
+
+    def store_image(self, data: bytes) -> str:
+        """Store PNG bytes and return their content hash"""
+        content_hash = hashlib.sha256(data).hexdigest()
+        path = self._image_path(content_hash)
+        if not os.path.exists(path):
+            width, height = Image.open(io.BytesIO(data)).size
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            now = time.time()
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO images (content_hash, byte_size, width, height, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (content_hash, len(data), width, height, now, now)
+                )
+        self._remember(content_hash, data)
+        return content_hash
+
+    def store_request(self, request_key: str, content_hashes: List[str]):
+        """Record which images a request produced, then evict over budget"""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM requests WHERE request_key = ?", (request_key,))
+            conn.executemany(
+                "INSERT INTO requests (request_key, position, content_hash, created_at) VALUES (?, ?, ?, ?)",
+                [(request_key, position, content_hash, now) for position, content_hash in enumerate(content_hashes)]
+            )
+        self.evict(keep=content_hashes)
+
+    def load(self, content_hash: str) -> Optional[bytes]:
+        """PNG bytes for a content hash, from memory when possible"""
+        with self._lock:
+            data = self._memory.get(content_hash)
+            if data is not None:
+                self._memory.move_to_end(content_hash)
+                return data
+
+        path = self._image_path(content_hash)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE images SET last_access = ? WHERE content_hash = ?", (time.time(), content_hash))
+        self._remember(content_hash, data)
+        return data
+
+    def evict(self, keep: List[str] = ()):
+        """Remove least recently used images until files fit within max_bytes"""
+        with closing(self._connect()) as conn, conn:
+            total = conn.execute("SELECT COALESCE(SUM(byte_size), 0) FROM images").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute("SELECT content_hash, byte_size FROM images ORDER BY last_access").fetchall()
+            for content_hash, byte_size in rows:
+                if total <= self.max_bytes:
+                    break
+                if content_hash in keep:
+                    continue
+                conn.execute("DELETE FROM images WHERE content_hash = ?", (content_hash,))
+                conn.execute(
+                    "DELETE FROM requests WHERE request_key IN "
+                    "(SELECT request_key FROM requests WHERE content_hash = ?)",
+                    (content_hash,)
+                )
+                path = self._image_path(content_hash)
+                if os.path.exists(path):
+                    os.remove(path)
+                self._forget(content_hash)
+                total -= byte_size
+
+
+@lru_cache(maxsize=None)
+def get_image_cache(cache_dir: str = DEFAULT_CACHE_DIR) -> GeneratedImageCache:
+    """Process-wide generated image cache"""
+    return GeneratedImageCache(cache_dir)
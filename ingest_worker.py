@@ -0,0 +1,141 @@
+import itertools
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+from instrumentation import span
+from pdf_ingest import ingest_pdfs, release_source, select_extractor
+from retrieval import PipelinedEmbedder, RetrievalIndex
+
+# Job states; finished jobs stay until collected with forget() or pruned
+QUEUED, RUNNING, INDEXING, DONE, FAILED, CANCELLED = "queued", "running", "indexing", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# Finished jobs kept for sessions that have not collected them yet
+MAX_FINISHED_JOBS = 100
+
+
+class IngestWorker:
+    """Background thread that extracts, caches and embeds PDFs from a job queue.
+
+    One instance serves every session, so work continues across Streamlit
+    reruns. Pages submit uploads and poll job() for progress. A finished
+    document is in the processor's document cache and its shards are in the
+    vector store, so adding it to a session's RetrievalIndex only loads them.
+    """
+
+    def __init__(self, processor, store, embed_fn=None):
+        self.processor = processor
+        self.store = store
+        self.embed_fn = embed_fn
+        self._jobs: Dict[str, Dict] = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._thread = threading.Thread(target=self._run, name="pdf-ingest", daemon=True)
+        self._thread.start()
+
+    def submit(self, filename: str, source, file_hash: str, source_size: Optional[int] = None) -> str:
+        """Queue a PDF (a pdf_ingest PdfSource, released once processed) and return its job id"""
+        job = {
+            'job_id': f"ingest-{next(self._ids)}",
+            'filename': filename,
+            'file_hash': file_hash,
+            'status': QUEUED,
+            'pages_done': 0,
+            'total_pages': 0,
+            'result': None,
+            'error': None,
+            'submitted_at': time.time(),
+            'finished_at': None
+        }
+        with self._lock:
+            self._jobs[job['job_id']] = job
+        self._queue.put((job['job_id'], source, source_size))
+        return job['job_id']
+
+    def job(self, job_id: str) -> Optional[Dict]:
+        """Snapshot of a job, or None if it is unknown or was forgotten"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def cancel(self, job_id: str):
+        """Cancel a queued job; a running job finishes, its results are cached anyway"""
+        self._update(job_id, only_if=QUEUED, status=CANCELLED, finished_at=time.time())
+
+    def forget(self, job_id: str):
+        """Drop a finished job once its session has collected it"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] not in FINISHED_STATES)
+
+    def _update(self, job_id: str, only_if: Optional[str] = None, **fields) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (only_if and job['status'] != only_if):
+                return False
+            job.update(fields)
+            return True
+
+    def _prune(self):
+        with self._lock:
+            finished = sorted((job['finished_at'], job_id) for job_id, job in self._jobs.items()
+                              if job['status'] in FINISHED_STATES)
+            for _, job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+                del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job_id, source, source_size = self._queue.get()
+            try:
+                if self._update(job_id, only_if=QUEUED, status=RUNNING):
+                    self._process(job_id, source, source_size)
+            except Exception as e:
+                self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+            finally:
+                release_source(source)
+                self._prune()
+
+    def _process(self, job_id: str, source, source_size: Optional[int]):
+        job = self.job(job_id)
+        filename, file_hash = job['filename'], job['file_hash']
+        # Pages are chunked and embedded as they finish, while the remaining pages are extracted
+        embedder = PipelinedEmbedder(self.embed_fn)
+        # Resolved up front, stored shards are only reused if built from this backend's text
+        extractor = select_extractor(source, self.processor.extractor)
+        embedding = not self.store.has_shard(file_hash, extractor)
+
+        def show_progress(_, pages_done, total_pages, fraction):
+            self._update(job_id, pages_done=pages_done, total_pages=total_pages)
+
+        def embed_segment(_, doc_id, pages):
+            if embedding:
+                embedder.submit(doc_id, filename, pages)
+
+        try:
+            with span("pdf.background_ingest", filename=filename):
+                # Finished page ranges are cached, so an interrupted run resumes where it stopped
+                result = ingest_pdfs([(filename, source, file_hash)], on_progress=show_progress,
+                                     segment_cache=self.processor.cache, on_segment=embed_segment,
+                                     extractor=extractor)[0]
+                if not result['stats']['words']:
+                    errors = "; ".join(message for page, message in result['errors'] if not page)
+                    self._update(job_id, status=FAILED, result=result, finished_at=time.time(),
+                                 error=errors or "No text could be extracted")
+                    return
+
+                self.processor.cache_pdf_content(file_hash, result['pages'], filename, result['stats'],
+                                                 source_size, result['extractor'])
+                self._update(job_id, status=INDEXING)
+                prepared = {file_hash: embedder.result(file_hash)} if embedding else None
+                # Writes the embedding and BM25 shards that sessions load when they add the document
+                RetrievalIndex(self.embed_fn, self.store).add_documents([(file_hash, filename, result['pages'])],
+                                                                        prepared, {file_hash: extractor})
+        finally:
+            embedder.close()
+        self._update(job_id, status=DONE, result=result, finished_at=time.time())
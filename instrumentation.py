@@ -0,0 +1,239 @@
+import functools
+import inspect
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# Span records are appended here as JSON lines, e.g. metrics/spans.jsonl (unset, the default, disables the export)
+SPAN_LOG_PATH = os.getenv("SPAN_LOG_PATH", "")
+
+# The span log is rotated to <path>.1 once it grows past this, so at most twice this is kept on disk
+SPAN_LOG_MAX_BYTES = int(os.getenv("SPAN_LOG_MAX_MB", "50")) * 1024 * 1024
+
+# Span lines waiting for the log writer; spans beyond this are dropped rather than blocking traced code
+SPAN_LOG_QUEUE_SIZE = 10000
+
+# Prometheus text exposition written by export_prometheus()
+PROMETHEUS_PATH = os.getenv("PROMETHEUS_METRICS_PATH", os.path.join("metrics", "metrics.prom"))
+
+# Set to 0 to hide the sidebar Performance panel
+SHOW_PERFORMANCE_PANEL = os.getenv("PERFORMANCE_PANEL", "1") != "0"
+
+# Most recent spans kept in memory for the Performance panel
+recent_spans = deque(maxlen=1000)
+
+_lock = threading.Lock()
+_span_totals = defaultdict(lambda: {'count': 0, 'errors': 0, 'seconds': 0.0})
+_counters = defaultdict(float)
+
+_span_log_queue = queue.Queue(maxsize=SPAN_LOG_QUEUE_SIZE)
+_span_log_writer = None
+
+
+def _write_span_log():
+    """Append queued span lines to SPAN_LOG_PATH in batches, rotating it once it is too large"""
+    while True:
+        lines = [_span_log_queue.get()]
+        while not _span_log_queue.empty():
+            lines.append(_span_log_queue.get_nowait())
+        try:
+            os.makedirs(os.path.dirname(SPAN_LOG_PATH) or ".", exist_ok=True)
+            if os.path.exists(SPAN_LOG_PATH) and os.path.getsize(SPAN_LOG_PATH) > SPAN_LOG_MAX_BYTES:
+                os.replace(SPAN_LOG_PATH, f"{SPAN_LOG_PATH}.1")
+            with open(SPAN_LOG_PATH, 'a', encoding='utf-8') as f:
+                f.writelines(lines)
+        except OSError:
+            pass
+
+
+def _log_span(record: Dict):
+    """Hand a span to the log writer thread, so traced code never waits on disk I/O"""
+    global _span_log_writer
+    if _span_log_writer is None:
+        with _lock:
+            if _span_log_writer is None:
+                _span_log_writer = threading.Thread(target=_write_span_log, name="span-log", daemon=True)
+                _span_log_writer.start()
+    try:
+        _span_log_queue.put_nowait(json.dumps(record, default=str) + "\n")
+    except queue.Full:
+        increment("span_log_dropped_total", record['name'], label_name="span")
+
+
+def record_span(record: Dict):
+    """Keep a finished span in memory, fold it into the totals and queue it for the JSONL log"""
+    with _lock:
+        recent_spans.append(record)
+        totals = _span_totals[record['name']]
+        totals['count'] += 1
+        totals['seconds'] += record['duration']
+        if record['error']:
+            totals['errors'] += 1
+        for key in ('prompt_tokens', 'completion_tokens', 'bytes_in', 'bytes_out'):
+            if record['attributes'].get(key):
+                _counters[(f"span_{key}_total", "span", record['name'])] += record['attributes'][key]
+
+    if SPAN_LOG_PATH:
+        _log_span(record)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict]:
+    """Time a block and record it as a span.
+
+    Yields the span's attribute dict, so the block can add token usage,
+    payload sizes or anything else it learns while running.
+    """
+    record = {
+        'name': name,
+        'start': time.time(),
+        'duration': 0.0,
+        'thread': threading.current_thread().name,
+        'error': None,
+        'attributes': attributes
+    }
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except GeneratorExit:
+        # A consumer stopping early is not a failure
+        raise
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['duration'] = time.perf_counter() - start
+        record_span(record)
+
+
+def traced(name: str):
+    """Decorator recording every call as a span; generators are timed until exhausted"""
+    def decorator(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                with span(name) as attributes:
+                    items = 0
+                    for item in fn(*args, **kwargs):
+                        items += 1
+                        yield item
+                    attributes['items'] = items
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def increment(name: str, label: str = "", amount: float = 1, label_name: str = "label"):
+    """Bump a counter exported alongside the span metrics"""
+    with _lock:
+        _counters[(name, label_name, label)] += amount
+
+
+def record_usage(attributes: Dict, usage) -> Dict:
+    """Copy token counts from an OpenAI usage object into span attributes"""
+    if usage is not None:
+        attributes['prompt_tokens'] = getattr(usage, 'prompt_tokens', None)
+        attributes['completion_tokens'] = getattr(usage, 'completion_tokens', None)
+    return attributes
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))]
+
+
+def summarize_spans(spans: Optional[List[Dict]] = None) -> List[Dict]:
+    """Per-span-name count, error count, latency percentiles, tokens and bytes, slowest total first"""
+    with _lock:
+        spans = list(recent_spans) if spans is None else spans
+    grouped = defaultdict(list)
+    for record in spans:
+        grouped[record['name']].append(record)
+
+    rows = []
+    for name, records in grouped.items():
+        durations = [record['duration'] for record in records]
+        def total(key):
+            return sum(record['attributes'].get(key) or 0 for record in records)
+        rows.append({
+            'span': name,
+            'count': len(records),
+            'errors': sum(1 for record in records if record['error']),
+            'p50 ms': round(percentile(durations, 0.5) * 1000, 1),
+            'p95 ms': round(percentile(durations, 0.95) * 1000, 1),
+            'total s': round(sum(durations), 2),
+            'tokens': int(total('prompt_tokens') + total('completion_tokens')),
+            'KB out': round(total('bytes_out') / 1024, 1)
+        })
+    return sorted(rows, key=lambda row: row['total s'], reverse=True)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text() -> str:
+    """Process totals in the Prometheus text exposition format"""
+    with _lock:
+        span_totals = {name: dict(totals) for name, totals in _span_totals.items()}
+        counters = dict(_counters)
+
+    lines = [
+        "# HELP app_span_seconds Time spent in instrumented spans",
+        "# TYPE app_span_seconds summary"
+    ]
+    for name, totals in sorted(span_totals.items()):
+        lines.append(f'app_span_seconds_count{{span="{_label(name)}"}} {totals["count"]}')
+        lines.append(f'app_span_seconds_sum{{span="{_label(name)}"}} {totals["seconds"]:.6f}')
+    lines += ["# HELP app_span_errors_total Spans that raised", "# TYPE app_span_errors_total counter"]
+    for name, totals in sorted(span_totals.items()):
+        lines.append(f'app_span_errors_total{{span="{_label(name)}"}} {totals["errors"]}')
+
+    by_metric = defaultdict(list)
+    for (metric, label_name, label), value in counters.items():
+        by_metric[metric].append((label_name, label, value))
+    for metric, values in sorted(by_metric.items()):
+        lines.append(f"# TYPE app_{metric} counter")
+        for label_name, label, value in sorted(values):
+            lines.append(f'app_{metric}{{{label_name}="{_label(label)}"}} {value:.15g}')
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(path: str = PROMETHEUS_PATH) -> str:
+    """Write prometheus_text() atomically to path, for a node exporter textfile collector or offline analysis"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+    return path
+
+
+def render_performance_panel():
+    """Sidebar "Performance" panel summarizing the spans recorded in this process"""
+    if not SHOW_PERFORMANCE_PANEL:
+        return
+    import streamlit as st
+
+    with st.sidebar.expander("⏱️ Performance", expanded=False):
+        rows = summarize_spans()
+        if not rows:
+            st.caption("No instrumented work yet")
+            return
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        with _lock:
+            retries = sum(value for (metric, _, _), value in _counters.items() if metric == "retries_total")
+        st.caption(f"{len(recent_spans)} recent spans, {int(retries)} retries"
+                   + (f", logged to {SPAN_LOG_PATH}" if SPAN_LOG_PATH else ""))
+        if st.button("Export Prometheus metrics", key="export_prometheus"):
+            st.success(f"Written to {export_prometheus()}")
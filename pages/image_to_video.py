@@ -1,17 +1,19 @@
 import streamlit as st
-import openai
-import requests
+import sys
 from PIL import Image, ImageDraw, ImageFont
 import io
 import os
 import base64
-import numpy as np
 from datetime import datetime
-from dotenv import load_dotenv
-import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Load environment variables
-load_dotenv()
+# Add the parent directory to the path to import utils (which also loads .env, once per process)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import get_openai_client, call_with_backoff
+from instrumentation import record_usage, render_performance_panel, span, traced
+from progression_video import VIDEO_FORMATS, DEFAULT_FPS, encode_progression_video
+from transitions import TRANSITIONS
 
 # Configure page
 st.set_page_config(
@@ -20,6 +22,7 @@ st.set_page_config(
     layout="wide"
 )
 
+@traced("image.encode")
 def encode_image_to_base64(image):
     """Convert PIL Image to base64 string"""
     buffered = io.BytesIO()
@@ -27,62 +30,105 @@ def encode_image_to_base64(image):
     img_str = base64.b64encode(buffered.getvalue()).decode()
     return img_str
 
-def generate_disease_progression_frames(disease_info, api_key, num_frames=5):
-    """Generate frames showing disease progression using DALL-E"""
+# Define progression stages
+PROGRESSION_STAGES = [
+    "Early stage - initial symptoms barely visible",
+    "Mild progression - early signs becoming apparent", 
+    "Moderate progression - clear manifestation of symptoms",
+    "Advanced stage - significant disease presentation",
+    "Severe stage - advanced disease characteristics"
+]
+
+# DALL-E generations in flight at once
+DEFAULT_FRAME_CONCURRENCY = 4
+
+def generate_stage_frame(client, disease_info, stage, stage_number):
+    """Generate, download and label the frame for one progression stage"""
+    prompt = f"""
+    Medical illustration of {disease_info['condition']} - {stage}.
+    Location: {disease_info['location']}
+    
+    Style: Professional medical illustration, clinical photography style,
+    educational medical content, anatomically accurate, clear visualization,
+    medical textbook quality, diagnostic imaging style, healthcare professional standard
+    
+    Show: {disease_info['visual_characteristics']} at {stage}
+    """
+    
+    with span("openai.image", model="dall-e-3", stage=stage_number):
+        response = client.images.generate(
+            prompt=prompt,
+            model="dall-e-3",
+            size="1024x1024",
+            quality="hd",
+            style="natural",
+            n=1
+        )
+    
+    # Download and store the image
+    import requests
+
+    with span("image.download", stage=stage_number) as attributes:
+        img_response = requests.get(response.data[0].url, timeout=120)
+        img_response.raise_for_status()
+        attributes['bytes_in'] = len(img_response.content)
+    frame_image = Image.open(io.BytesIO(img_response.content))
+    
+    # Add stage label to frame
+    frame_with_label = add_stage_label(frame_image, f"Stage {stage_number}: {stage}")
+    
+    return {
+        'image': frame_with_label,
+        'stage': stage,
+        'stage_number': stage_number
+    }
+
+def generate_disease_progression_frames(disease_info, api_key, num_frames=5,
+                                        max_concurrency=DEFAULT_FRAME_CONCURRENCY,
+                                        on_frame=None, on_error=None):
+    """Generate frames showing disease progression using DALL-E.
+
+    Stages are generated and downloaded concurrently, each retried on its own
+    when it fails. on_frame(frame) and on_error(stage_number, stage, message)
+    are called from the calling thread as stages finish. Returns the frames
+    that succeeded, ordered by stage.
+    """
+    import requests
+
     try:
-        openai.api_key = api_key
+        client = get_openai_client(api_key)
+        stages = PROGRESSION_STAGES[:num_frames]
         generated_frames = []
         
-        # Define progression stages
-        progression_stages = [
-            "Early stage - initial symptoms barely visible",
-            "Mild progression - early signs becoming apparent", 
-            "Moderate progression - clear manifestation of symptoms",
-            "Advanced stage - significant disease presentation",
-            "Severe stage - advanced disease characteristics"
-        ]
-        
-        # Generate frames for each stage
-        for i, stage in enumerate(progression_stages[:num_frames]):
-            prompt = f"""
-            Medical illustration of {disease_info['condition']} - {stage}.
-            Location: {disease_info['location']}
-            
-            Style: Professional medical illustration, clinical photography style,
-            educational medical content, anatomically accurate, clear visualization,
-            medical textbook quality, diagnostic imaging style, healthcare professional standard
-            
-            Show: {disease_info['visual_characteristics']} at {stage}
-            """
-            
-            with st.spinner(f"Generating frame {i+1}/{num_frames} - {stage}..."):
-                response = openai.Image.create(
-                    prompt=prompt,
-                    model="dall-e-3",
-                    size="1024x1024",
-                    quality="hd",
-                    style="natural",
-                    n=1
-                )
-                
-                # Download and store the image
-                img_response = requests.get(response.data[0].url)
-                frame_image = Image.open(io.BytesIO(img_response.content))
-                
-                # Add stage label to frame
-                frame_with_label = add_stage_label(frame_image, f"Stage {i+1}: {stage}")
-                
-                generated_frames.append({
-                    'image': frame_with_label,
-                    'stage': stage,
-                    'stage_number': i+1
-                })
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(stages)))) as executor:
+            futures = {
+                executor.submit(
+                    call_with_backoff, generate_stage_frame, client, disease_info, stage, i + 1,
+                    max_retries=3, retry_on=(requests.RequestException,)
+                ): (i + 1, stage)
+                for i, stage in enumerate(stages)
+            }
+            for future in as_completed(futures):
+                stage_number, stage = futures[future]
+                try:
+                    frame = future.result()
+                except Exception as e:
+                    if on_error:
+                        on_error(stage_number, stage, str(e))
+                    continue
+                generated_frames.append(frame)
+                if on_frame:
+                    on_frame(frame)
+        
+        if stages and not generated_frames:
+            raise Exception("no stage could be generated")
         
-        return generated_frames
+        return sorted(generated_frames, key=lambda frame: frame['stage_number'])
         
     except Exception as e:
-        raise Exception(f"Error generating progression frames: {str(e)}")
+        raise Exception(f"Error generating progression frames: {str(e)}") from e
 
+@traced("image.label")
 def add_stage_label(image, label_text):
     """Add stage label to the image"""
     try:
@@ -117,7 +163,7 @@ def add_stage_label(image, label_text):
 def create_progression_analysis(disease_info, api_key, model="gpt-4o"):
     """Generate detailed analysis of disease progression"""
     try:
-        openai.api_key = api_key
+        client = get_openai_client(api_key)
         
         analysis_prompt = f"""
         As a medical education specialist, provide a comprehensive analysis of {disease_info['condition']} progression:
@@ -141,21 +187,23 @@ def create_progression_analysis(disease_info, api_key, model="gpt-4o"):
         **Disclaimer**: Include appropriate medical disclaimers about individual variation and professional consultation.
         """
         
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a medical education specialist with expertise in disease progression and pathology. Provide comprehensive, educational analysis for healthcare professionals and medical students."
-                },
-                {
-                    "role": "user",
-                    "content": analysis_prompt
-                }
-            ],
-            max_tokens=2000,
-            temperature=0.1
-        )
+        with span("openai.chat", model=model) as attributes:
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a medical education specialist with expertise in disease progression and pathology. Provide comprehensive, educational analysis for healthcare professionals and medical students."
+                    },
+                    {
+                        "role": "user",
+                        "content": analysis_prompt
+                    }
+                ],
+                max_tokens=2000,
+                temperature=0.1
+            )
+            record_usage(attributes, response.usage)
         
         return response.choices[0].message.content
         
@@ -194,7 +242,8 @@ def main():
         
         # Video settings
         st.subheader("📹 Video Parameters")
-        num_frames = st.slider("Number of Stages", 3, 8, 5, help="Number of progression stages to generate")
+        num_frames = st.slider("Number of Stages", 3, len(PROGRESSION_STAGES), 5, help="Number of progression stages to generate")
+        frame_concurrency = st.slider("Parallel Generations", 1, 8, DEFAULT_FRAME_CONCURRENCY, help="How many stages are generated at the same time")
         frame_duration = st.slider("Stage Duration (seconds)", 1, 10, 3, help="How long each stage is displayed")
         
         # Disease categories
@@ -347,13 +396,35 @@ def main():
         # Generate video frames
         if hasattr(st.session_state, 'generate_frames') and st.session_state.generate_frames:
             if st.button("🎬 Start Frame Generation"):
+                # One slot per stage, filled in as soon as that stage is ready
+                live_area = st.empty()
+                with live_area.container():
+                    stage_slots = [st.empty() for _ in range(st.session_state.num_frames)]
+                    for slot, stage in zip(stage_slots, PROGRESSION_STAGES):
+                        slot.info(f"⏳ Generating {stage}...")
+                
+                def show_frame(frame):
+                    stage_slots[frame['stage_number'] - 1].image(
+                        frame['image'], caption=f"Stage {frame['stage_number']}", use_column_width=True
+                    )
+                
+                def show_error(stage_number, stage, message):
+                    stage_slots[stage_number - 1].error(f"❌ Stage {stage_number} ({stage}) failed: {message}")
+                
                 try:
                     frames = generate_disease_progression_frames(
                         st.session_state.disease_info, 
                         api_key, 
-                        st.session_state.num_frames
+                        st.session_state.num_frames,
+                        max_concurrency=frame_concurrency,
+                        on_frame=show_frame,
+                        on_error=show_error
                     )
+                    live_area.empty()
+                    if len(frames) < st.session_state.num_frames:
+                        st.warning(f"⚠️ {st.session_state.num_frames - len(frames)} stage(s) could not be generated")
                     st.session_state.progression_frames = frames
+                    st.session_state.pop('progression_video', None)
                     st.session_state.generate_frames = False
                     st.success("✅ Video frames generated successfully!")
                 except Exception as e:
@@ -409,23 +480,67 @@ def main():
                 
                 st.markdown("---")
             
-            # Video creation instructions
+            # Build the video in-process
             st.markdown("### 🎬 Create Video:")
-            st.info("""
-            **To create a video from these frames:**
-            1. Download all frames using the buttons above
-            2. Use video editing software (e.g., Adobe Premiere, DaVinci Resolve, or free tools like OpenShot)
-            3. Import frames in sequence
-            4. Set frame duration to your preferred timing
-            5. Add transitions between stages
-            6. Export as MP4 for sharing
+            col_format, col_style, col_transition = st.columns(3)
+            with col_format:
+                video_format = st.selectbox("Video Format", list(VIDEO_FORMATS.keys()))
+            with col_style:
+                transition = st.selectbox(
+                    "Transition", TRANSITIONS, format_func=str.title,
+                    help="Morph warps each stage toward the next along estimated optical flow"
+                )
+            with col_transition:
+                # A transition is taken from a stage's duration, one-second stages leave no room for one
+                max_transition = float(frame_duration - 1)
+                if max_transition > 0:
+                    transition_seconds = st.slider(
+                        "Transition (seconds)", 0.0, max_transition, min(1.0, frame_duration / 2, max_transition), 0.5,
+                        help="Length of the transition between stages, taken from each stage's duration"
+                    )
+                else:
+                    transition_seconds = 0.0
+                    st.caption("Stages switch without a transition at 1 second per stage")
+            
+            if st.button("🎞️ Build Video", type="primary"):
+                try:
+                    with st.spinner("🎞️ Encoding video..."):
+                        extension = VIDEO_FORMATS[video_format]["extension"]
+                        with tempfile.TemporaryDirectory() as tmp_dir:
+                            video = encode_progression_video(
+                                st.session_state.progression_frames,
+                                os.path.join(tmp_dir, f"progression{extension}"),
+                                stage_seconds=frame_duration,
+                                transition_seconds=transition_seconds,
+                                video_format=video_format,
+                                transition=transition
+                            )
+                            with open(video['path'], 'rb') as f:
+                                video['data'] = f.read()
+                        video['extension'] = extension
+                        st.session_state.progression_video = video
+                except Exception as e:
+                    st.error(f"❌ Error creating video: {str(e)}")
             
-            **Suggested video settings:**
-            - Frame rate: 1-2 FPS for educational viewing
-            - Add fade transitions between stages
-            - Include stage labels and timestamps
-            - Add narration or background music if desired
-            """)
+            if hasattr(st.session_state, 'progression_video'):
+                video = st.session_state.progression_video
+                if video.get('browser_playable', True):
+                    st.video(video['data'], format=video['mime'])
+                else:
+                    st.warning(f"⚠️ This OpenCV build encoded the video with the {video['codec']} codec, which "
+                               f"browsers cannot play, so there is no preview. Download it to watch it in a "
+                               f"desktop player, or choose WebM for an inline preview.")
+                st.caption(f"{video['duration']:.1f}s at {DEFAULT_FPS} fps, {video['codec']} codec, "
+                           f"{video.get('transition', 'crossfade')} transitions, "
+                           f"{len(video['data']) / 1024 / 1024:.1f} MB, encoded in {video['encode_time']:.1f}s")
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                st.download_button(
+                    label="📥 Download Video",
+                    data=video['data'],
+                    file_name=f"disease_progression_{timestamp}{video['extension']}",
+                    mime=video['mime'],
+                    key="download_video"
+                )
         
         else:
             st.info("🎬 Disease progression frames will appear here")
@@ -482,4 +597,5 @@ def main():
         """)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    render_performance_panel()
\ No newline at end of file
@@ -1,15 +1,18 @@
 import streamlit as st
-from openai import OpenAI
-import requests
+import sys
 from PIL import Image
 import io
 import os
 import base64
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+# Add the parent directory to the path to import utils (which also loads .env, once per process)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import get_openai_client, call_with_backoff
+from instrumentation import render_performance_panel, record_usage, span
 
 # Configure page
 st.set_page_config(
@@ -18,21 +21,105 @@ st.set_page_config(
     layout="wide"
 )
 
-def encode_image_to_base64(image):
-    """Convert PIL Image to base64 string"""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return img_str
+# GPT-4o vision fits images into 2048x2048 and then scales the shortest side
+# to 768px, so anything larger is only extra upload
+VISION_MAX_SIDE = 2048
+VISION_SHORT_SIDE = 768
 
-def analyze_medical_image(image, analysis_type, api_key, model="gpt-4o"):
+# Encoding per analysis type: radiographs stay lossless, photos use JPEG
+IMAGE_ENCODING = {
+    "general_analysis": {"format": "JPEG", "quality": 90},
+    "skin_analysis": {"format": "JPEG", "quality": 92},
+    "xray_analysis": {"format": "PNG"},
+    "eye_analysis": {"format": "JPEG", "quality": 92},
+    "wound_analysis": {"format": "JPEG", "quality": 88},
+    "symptom_analysis": {"format": "JPEG", "quality": 88}
+}
+
+def prepare_image_for_vision(image, analysis_type="general_analysis", original_bytes=None):
+    """Resize and encode an image for the vision model.
+
+    Returns a dict with the base64 payload, its MIME type and encoding stats.
+    """
+    with span("image.encode", analysis_type=analysis_type) as attributes:
+        start_time = time.perf_counter()
+        settings = IMAGE_ENCODING.get(analysis_type, IMAGE_ENCODING["general_analysis"])
+    
+        # Convert to a mode the target format can store
+        if settings["format"] == "PNG":
+            if image.mode in ("I", "I;16", "F"):
+                # Stretch 16-bit and float radiographs into 8 bits instead of clipping them
+                wide = image.convert("F")
+                low, high = wide.getextrema()
+                stretch = 255.0 / (high - low) if high > low else 1.0
+                prepared = wide.point(lambda value: (value - low) * stretch).convert("L")
+            elif image.mode in ("L", "RGB"):
+                prepared = image
+            else:
+                prepared = image.convert("L" if image.mode == "LA" else "RGB")
+        elif image.mode in ("RGBA", "LA", "P"):
+            # Flatten transparency onto white rather than black
+            rgba = image.convert("RGBA")
+            prepared = Image.new("RGB", rgba.size, (255, 255, 255))
+            prepared.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            prepared = image.convert("RGB")
+    
+        # Downscale to the model's effective resolution
+        width, height = prepared.size
+        scale = min(1.0, VISION_MAX_SIDE / max(width, height), VISION_SHORT_SIDE / min(width, height))
+        if scale < 1.0:
+            new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            prepared = prepared.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+        elif prepared is image:
+            prepared = image.copy()
+    
+        # Drop EXIF, ICC profiles and other metadata
+        prepared.info = {}
+    
+        buffered = io.BytesIO()
+        if settings["format"] == "PNG":
+            prepared.save(buffered, format="PNG", optimize=False, compress_level=6)
+            mime_type = "image/png"
+        else:
+            prepared.save(buffered, format="JPEG", quality=settings["quality"], optimize=True)
+            mime_type = "image/jpeg"
+        encoded = buffered.getvalue()
+        attributes.update(bytes_in=original_bytes, bytes_out=len(encoded), format=settings["format"])
+    
+        return {
+            "base64": base64.b64encode(encoded).decode(),
+            "mime_type": mime_type,
+            "format": settings["format"],
+            "original_dimensions": image.size,
+            "dimensions": prepared.size,
+            "original_bytes": original_bytes,
+            "encoded_bytes": len(encoded),
+            "bytes_saved": original_bytes - len(encoded) if original_bytes else None,
+            "encode_time": time.perf_counter() - start_time
+        }
+
+def encode_image_to_base64(image, analysis_type="general_analysis"):
+    """Convert PIL Image to a base64 string sized and encoded for the vision model"""
+    return prepare_image_for_vision(image, analysis_type)["base64"]
+
+def format_payload_stats(payload):
+    """Human readable summary of prepare_image_for_vision stats"""
+    width, height = payload["dimensions"]
+    summary = f"📦 Sent {payload['encoded_bytes'] / 1024:,.0f} KB as {payload['format']} {width}x{height}"
+    if payload["bytes_saved"] is not None:
+        summary += f", {payload['bytes_saved'] / 1024:,.0f} KB smaller than the upload"
+    return summary + f" (encoded in {payload['encode_time'] * 1000:.0f} ms)"
+
+def analyze_medical_image(image, analysis_type, api_key, model="gpt-4o", payload=None):
     """Analyze medical image using OpenAI's vision model"""
     try:
-        # Encode image to base64
-        base64_image = encode_image_to_base64(image)
+        # Resize and encode the image unless the caller already did
+        if payload is None:
+            payload = prepare_image_for_vision(image, analysis_type)
         
-        # Set up OpenAI client
-        client = OpenAI(api_key=api_key)
+        # Shared OpenAI client with pooled connections
+        client = get_openai_client(api_key)
         
         # Create specialized medical prompts
         medical_prompts = {
@@ -106,37 +193,197 @@ def analyze_medical_image(image, analysis_type, api_key, model="gpt-4o"):
         prompt = medical_prompts.get(analysis_type, medical_prompts["general_analysis"])
         
         # Create the message
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a medical AI assistant designed to help healthcare professionals analyze medical images. Provide detailed, structured analysis while emphasizing the importance of professional medical consultation. Always include disclaimers about the limitations of AI analysis."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
+        with span("openai.vision", model=model, analysis_type=analysis_type,
+                  bytes_out=len(payload['base64'])) as attributes:
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a medical AI assistant designed to help healthcare professionals analyze medical images. Provide detailed, structured analysis while emphasizing the importance of professional medical consultation. Always include disclaimers about the limitations of AI analysis."
+                    },
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": prompt
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:{payload['mime_type']};base64,{payload['base64']}"
+                                }
                             }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=1500,
-            temperature=0.1  # Low temperature for more consistent medical analysis
-        )
+                        ]
+                    }
+                ],
+                max_tokens=1500,
+                temperature=0.1  # Low temperature for more consistent medical analysis
+            )
+            record_usage(attributes, response.usage)
         
         return response.choices[0].message.content
         
     except Exception as e:
-        raise Exception(f"Error analyzing medical image: {str(e)}")
+        raise Exception(f"Error analyzing medical image: {str(e)}") from e
+
+# Batch triage settings
+BATCH_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff', '.tif')
+DEFAULT_BATCH_CONCURRENCY = 4
+MAX_BATCH_CONCURRENCY = 16
+
+def list_batch_images(uploaded_files):
+    """Collect (name, upload, zip member name or None, byte size) from uploaded images and zip archives.
+
+    Nothing is decoded here; each image is read and decoded by the task that analyzes it.
+    """
+    images = []
+    for uploaded in uploaded_files:
+        if uploaded.name.lower().endswith('.zip'):
+            with zipfile.ZipFile(uploaded) as archive:
+                for member in archive.infolist():
+                    name = member.filename
+                    if member.is_dir() or name.startswith('__MACOSX/') or not name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                        continue
+                    images.append((name, uploaded, name, member.file_size))
+        else:
+            images.append((uploaded.name, uploaded, None, uploaded.size))
+    return images
+
+def open_batch_image(uploaded, member=None):
+    """Decode one image of a batch, from an upload or a member of an uploaded zip"""
+    # A BytesIO per task over the upload's bytes, so concurrent tasks never share a file position
+    data = io.BytesIO(uploaded.getvalue())
+    if member is not None:
+        with zipfile.ZipFile(data) as archive:
+            data = io.BytesIO(archive.read(member))
+    image = Image.open(data)
+    image.load()
+    return image
+
+def analyze_medical_images_batch(images, analysis_type, api_key, model="gpt-4o",
+                                 max_concurrency=DEFAULT_BATCH_CONCURRENCY):
+    """Analyze (name, upload, zip member, byte size) tuples from list_batch_images concurrently.
+
+    At most max_concurrency requests are in flight; rate-limited and transient
+    failures are retried with backoff. Images are decoded inside their task,
+    so only the ones being analyzed are in memory. Yields result dicts as they
+    complete.
+    """
+    def analyze_one(index, name, uploaded, member, image_bytes):
+        start_time = time.perf_counter()
+        try:
+            image = open_batch_image(uploaded, member)
+            payload = prepare_image_for_vision(image, analysis_type, image_bytes)
+            report = call_with_backoff(
+                analyze_medical_image, image, analysis_type, api_key, model, payload=payload
+            )
+            error = None
+        except Exception as e:
+            report = None
+            error = str(e)
+        return {
+            'index': index,
+            'name': name,
+            'report': report,
+            'error': error,
+            'seconds': time.perf_counter() - start_time
+        }
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = [
+            executor.submit(analyze_one, index, name, uploaded, member, image_bytes)
+            for index, (name, uploaded, member, image_bytes) in enumerate(images)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+def summarize_report(report, max_length=120):
+    """First meaningful line of a report, for the results table"""
+    for line in (report or "").splitlines():
+        line = line.strip(" #*-")
+        if line:
+            return line if len(line) <= max_length else line[:max_length - 1] + "…"
+    return ""
+
+def render_batch_mode(api_key, model, analysis_type, max_concurrency):
+    """Multi-image triage: analyze many images concurrently and stream results into a table"""
+    # pandas is only needed here, so single-image mode never pays for importing it
+    import pandas as pd
+
+    st.subheader("🗂️ Batch Triage")
+    uploaded_files = st.file_uploader(
+        "Upload Medical Images or a Zip Archive",
+        type=['png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'zip'],
+        accept_multiple_files=True,
+        help="Select many images at once, or upload a .zip of a folder"
+    )
+    
+    if not uploaded_files:
+        st.info("🗂️ Upload images or a zip archive to triage them in one run")
+        return
+    
+    # Uploads are only listed again when they change, not on every rerun
+    upload_key = tuple(uploaded.file_id for uploaded in uploaded_files)
+    if st.session_state.get('batch_upload_key') != upload_key:
+        try:
+            st.session_state.batch_images = list_batch_images(uploaded_files)
+        except Exception as e:
+            st.error(f"❌ Could not read uploads: {str(e)}")
+            return
+        st.session_state.batch_upload_key = upload_key
+    images = st.session_state.batch_images
+    st.info(f"📊 {len(images)} images ready, up to {max_concurrency} analyzed at a time")
+    
+    if st.button("🔍 Analyze All Images", type="primary", disabled=not (api_key and images)):
+        progress_bar = st.progress(0)
+        table = st.empty()
+        rows = [{'File': name, 'Status': '⏳ Queued', 'Seconds': None, 'Summary': ''} for name, *_ in images]
+        table.dataframe(pd.DataFrame(rows), use_container_width=True)
+        
+        results = [None] * len(images)
+        batch_start = time.perf_counter()
+        for done, result in enumerate(
+            analyze_medical_images_batch(images, analysis_type, api_key, model, max_concurrency), start=1
+        ):
+            results[result['index']] = result
+            rows[result['index']] = {
+                'File': result['name'],
+                'Status': '❌ Failed' if result['error'] else '✅ Done',
+                'Seconds': round(result['seconds'], 1),
+                'Summary': result['error'] or summarize_report(result['report'])
+            }
+            table.dataframe(pd.DataFrame(rows), use_container_width=True)
+            progress_bar.progress(done / len(images))
+        
+        wall_time = time.perf_counter() - batch_start
+        table.empty()
+        progress_bar.empty()
+        st.session_state.batch_results = results
+        st.session_state.batch_rows = rows
+        st.session_state.batch_timing = (wall_time, sum(result['seconds'] for result in results))
+    
+    # Results of the last batch
+    if st.session_state.get('batch_results'):
+        wall_time, total_latency = st.session_state.batch_timing
+        st.success(f"✅ {len(st.session_state.batch_results)} images analyzed in {wall_time:.1f}s "
+                   f"({total_latency:.1f}s of request time)")
+        rows_frame = pd.DataFrame(st.session_state.batch_rows)
+        st.dataframe(rows_frame, use_container_width=True)
+        st.download_button(
+            "📥 Download Results (CSV)",
+            data=pd.DataFrame([
+                {'File': result['name'], 'Report': result['report'] or '', 'Error': result['error'] or ''}
+                for result in st.session_state.batch_results
+            ]).to_csv(index=False),
+            file_name=f"medical_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            mime="text/csv"
+        )
+        for result in st.session_state.batch_results:
+            if result['report']:
+                with st.expander(f"🏥 {result['name']}"):
+                    st.markdown(result['report'])
 
 def main():
     st.title("🏥 Medical Image Analyzer")
@@ -193,6 +440,19 @@ def main():
         detailed_analysis = st.checkbox("Detailed Analysis", value=True, help="Provide comprehensive analysis")
         include_urgency = st.checkbox("Include Urgency Assessment", value=True, help="Assess urgency level")
         
+        # Single image or batch triage
+        st.subheader("Mode")
+        analysis_mode = st.radio("Analysis Mode", ["Single Image", "Batch Triage"], horizontal=True)
+        if analysis_mode == "Batch Triage":
+            max_concurrency = st.slider(
+                "Concurrent Requests", 1, MAX_BATCH_CONCURRENCY, DEFAULT_BATCH_CONCURRENCY,
+                help="How many images are analyzed at the same time. Lower this if you hit rate limits."
+            )
+    
+    if analysis_mode == "Batch Triage":
+        render_batch_mode(api_key, model, analysis_type, max_concurrency)
+        return
+        
     # Main content area
     col1, col2 = st.columns([1, 1])
     
@@ -222,9 +482,11 @@ def main():
         
         # Display uploaded or sample image
         image_to_analyze = None
+        image_bytes = None
         
         if uploaded_file is not None:
             image_to_analyze = Image.open(uploaded_file)
+            image_bytes = uploaded_file.size
             st.image(image_to_analyze, caption="Medical Image for Analysis", use_column_width=True)
             
             # Image info
@@ -232,8 +494,13 @@ def main():
             
         elif hasattr(st.session_state, 'sample_image_url'):
             try:
-                response = requests.get(st.session_state.sample_image_url)
+                import requests
+
+                with span("image.download") as attributes:
+                    response = requests.get(st.session_state.sample_image_url)
+                    attributes['bytes_in'] = len(response.content)
                 image_to_analyze = Image.open(io.BytesIO(response.content))
+                image_bytes = len(response.content)
                 st.image(image_to_analyze, caption="Demo Medical Image", use_column_width=True)
             except Exception as e:
                 st.error(f"Error loading demo image: {str(e)}")
@@ -246,6 +513,7 @@ def main():
                 st.error("Please upload a medical image")
             else:
                 st.session_state.analysis_image = image_to_analyze
+                st.session_state.analysis_image_bytes = image_bytes
                 st.session_state.analysis_type = analysis_type
                 st.session_state.analysis_model = model
     
@@ -257,14 +525,21 @@ def main():
             if st.button("🔍 Start Analysis", key="analyze_btn"):
                 try:
                     with st.spinner("🔬 Analyzing medical image... This may take up to 30 seconds"):
+                        payload = prepare_image_for_vision(
+                            st.session_state.analysis_image,
+                            st.session_state.analysis_type,
+                            st.session_state.get("analysis_image_bytes")
+                        )
                         result = analyze_medical_image(
                             st.session_state.analysis_image,
                             st.session_state.analysis_type,
                             api_key,
-                            st.session_state.analysis_model
+                            st.session_state.analysis_model,
+                            payload=payload
                         )
                         
                         st.session_state.analysis_result = result
+                        st.session_state.analysis_payload_stats = format_payload_stats(payload)
                         st.success("✅ Medical analysis complete!")
                         
                 except Exception as e:
@@ -273,6 +548,8 @@ def main():
         # Display results
         if hasattr(st.session_state, 'analysis_result'):
             st.markdown("### 🏥 Medical Analysis Report:")
+            if st.session_state.get("analysis_payload_stats"):
+                st.caption(st.session_state.analysis_payload_stats)
             
             # Display analysis in a formatted way
             with st.container():
@@ -319,4 +596,5 @@ def main():
             st.info("🔬 Medical analysis results will appear here after analyzing an image")
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
+    render_performance_panel()
\ No newline at end of file
@@ -1,85 +1,61 @@
 import streamlit as st
 import sys
 import os
-from dotenv import load_dotenv
-import PyPDF2
-import io
-from typing import List, Dict
-import hashlib
-import pickle
+from typing import Dict, List
+import time
 
-# Load environment variables
-load_dotenv()
-
-# Add the parent directory to the path
+# Add the parent directory to the path (importing utils also loads .env, once per process)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from openai import OpenAI
+from utils import complete_chat, replay_reply, streamlit_renderer, format_chat_stats
+from response_cache import SemanticResponseCache, get_response_cache, make_scope
+from retrieval import RetrievalIndex, DEFAULT_TOP_K, embedding_signature
+from prompt_builder import build_messages
+from vector_store import VectorShardStore
+from pdf_ingest import (EXTRACTOR_VERSION, PDF_EXTRACTOR, hash_upload, select_extractor, summarize_pages,
+                        upload_source)
+from document_cache import DocumentCache
+from ingest_worker import (DONE as JOB_DONE, FINISHED_STATES, INDEXING as JOB_INDEXING, QUEUED as JOB_QUEUED,
+                           IngestWorker)
+from instrumentation import render_performance_panel
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+PDF_CACHE_DIR = "pdf_cache"
 
 class PDFProcessor:
-    def __init__(self):
-        self.pdf_cache_dir = "pdf_cache"
+    def __init__(self, extractor: str = PDF_EXTRACTOR, on_evict=None):
+        self.pdf_cache_dir = PDF_CACHE_DIR
         if not os.path.exists(self.pdf_cache_dir):
             os.makedirs(self.pdf_cache_dir)
+        # on_evict is wired before the cache drops stale entries, so their shards go with them
+        self.cache = DocumentCache(self.pdf_cache_dir, EXTRACTOR_VERSION, on_evict=on_evict)
+        # A pdf_ingest.EXTRACTOR_BACKENDS name, or "auto" for the fastest one measured
+        self.extractor = extractor
     
-    def extract_text_from_pdf(self, pdf_file) -> str:
-        """Extract text from a PDF file"""
-        try:
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_file.read()))
-            text = ""
-            for page_num, page in enumerate(pdf_reader.pages):
-                try:
-                    page_text = page.extract_text()
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}\n"
-                except Exception as e:
-                    st.warning(f"Could not extract text from page {page_num + 1}: {str(e)}")
-                    continue
-            return text
-        except Exception as e:
-            st.error(f"Error processing PDF {pdf_file.name}: {str(e)}")
-            return ""
-    
-    def get_file_hash(self, pdf_file) -> str:
-        """Generate hash for file caching"""
-        pdf_file.seek(0)
-        content = pdf_file.read()
-        pdf_file.seek(0)
-        return hashlib.md5(content).hexdigest()
-    
-    def cache_pdf_content(self, file_hash: str, content: str, filename: str):
-        """Cache extracted PDF content"""
-        cache_data = {
-            'content': content,
-            'filename': filename
-        }
-        cache_path = os.path.join(self.pdf_cache_dir, f"{file_hash}.pkl")
-        with open(cache_path, 'wb') as f:
-            pickle.dump(cache_data, f)
+    def cache_pdf_content(self, file_hash: str, pages: List[Dict], filename: str, stats: Dict = None,
+                          source_size: int = None, extractor: str = None):
+        """Cache extracted PDF page records, their statistics and the backend that extracted them"""
+        self.cache.store(file_hash, filename, pages, stats or summarize_pages(pages), source_size,
+                         extractor or select_extractor(extractor=self.extractor))
     
     def load_cached_content(self, file_hash: str) -> Dict:
-        """Load cached PDF content"""
-        cache_path = os.path.join(self.pdf_cache_dir, f"{file_hash}.pkl")
-        if os.path.exists(cache_path):
-            with open(cache_path, 'rb') as f:
-                return pickle.load(f)
-        return None
-
-def get_pdf_based_response(question: str, pdf_contents: Dict[str, str], chat_history: List = None) -> tuple:
-    """Get response based only on PDF content"""
-    
-    # Combine all PDF contents
-    combined_content = ""
-    for filename, content in pdf_contents.items():
-        combined_content += f"\n\n=== Content from {filename} ===\n{content}\n"
-    
-    if not combined_content.strip():
-        return "I don't have any PDF content to answer your question. Please upload some PDF files first.", chat_history or []
-    
-    # Create system prompt
-    system_prompt = f"""You are a helpful assistant that answers questions ONLY based on the provided PDF content. 
+        """Load cached PDF page records"""
+        return self.cache.load(file_hash)
+
+# Seconds between progress updates while background ingestion runs
+JOB_POLL_SECONDS = 1.0
+
+# Part of the response cache key, bump when the system prompt below or retrieval changes
+PDF_PROMPT_VERSION = "pdf-prompt-3"
+
+PDF_MODEL = "gpt-4"
+
+# Room reserved for the answer in the model's context window
+PDF_ANSWER_TOKENS = 1000
+
+# Chunks retrieved per question; as many as fit the excerpt budget are sent
+PDF_CANDIDATE_CHUNKS = DEFAULT_TOP_K * 4
+
+PDF_SYSTEM_PROMPT = """You are a helpful assistant that answers questions ONLY based on the provided PDF content. 
 
 IMPORTANT RULES:
 1. Only use information from the provided PDF content below
@@ -88,30 +64,55 @@ IMPORTANT RULES:
 4. Be accurate and don't make up information not present in the PDFs
 5. If asked about something not in the PDFs, politely explain that you can only answer based on the uploaded documents
 
-PDF CONTENT:
-{combined_content}
+PDF CONTENT (most relevant excerpts):
+{context}
 
 Remember: Answer ONLY based on the above PDF content."""
 
-    # Prepare messages
-    messages = [{"role": "system", "content": system_prompt}]
+def get_pdf_based_response(question: str, pdf_index: RetrievalIndex, chat_history: List = None,
+                           top_k: int = PDF_CANDIDATE_CHUNKS, render=None,
+                           cache: SemanticResponseCache = None) -> tuple:
+    """Get response based only on the PDF chunks most relevant to the question.
+
+    When render is given the reply is streamed through it as it is generated.
+    When cache is given, answers to the same opening question over the same documents
+    are reused; follow-ups depend on the conversation and are never cached.
+    """
     
-    # Add chat history if available
+    if pdf_index is None or len(pdf_index) == 0:
+        return "I don't have any PDF content to answer your question. Please upload some PDF files first.", chat_history or []
+    
+    # Repeated opening questions against the same document set are answered from the cache
     if chat_history:
-        messages.extend(chat_history)
+        cache = None
+    cache_scope = make_scope("pdf", PDF_PROMPT_VERSION, pdf_index.document_set_hash())
+    if cache is not None:
+        lookup_start = time.perf_counter()
+        cached_reply = cache.get(cache_scope, question)
+        if cached_reply is not None:
+            reply, _ = replay_reply(cached_reply, render, time.perf_counter() - lookup_start)
+            updated_history = chat_history if chat_history else []
+            updated_history.append({"role": "user", "content": question})
+            updated_history.append({"role": "assistant", "content": reply})
+            return reply, updated_history
     
-    # Add current question
-    messages.append({"role": "user", "content": question})
+    # Retrieve the most relevant chunks instead of sending every document
+    relevant_chunks = pdf_index.search(question, top_k=top_k)
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            max_tokens=1000,
+        # Pack as many excerpts as fit next to the recent history, leaving room for the answer
+        prompt = build_messages(PDF_SYSTEM_PROMPT, question, relevant_chunks, chat_history,
+                                model=PDF_MODEL, answer_tokens=PDF_ANSWER_TOKENS)
+        
+        reply, _ = complete_chat(
+            prompt['messages'],
+            model=PDF_MODEL,
+            render=render,
+            max_tokens=PDF_ANSWER_TOKENS,
             temperature=0.3  # Lower temperature for more factual responses
         )
-        
-        reply = response.choices[0].message.content
+        if cache is not None and reply:
+            cache.put(cache_scope, question, reply)
         
         # Update chat history
         updated_history = chat_history if chat_history else []
@@ -170,9 +171,59 @@ if "pdf_chat_history" not in st.session_state:
     st.session_state.pdf_chat_history = []
 if "pdf_input_key" not in st.session_state:
     st.session_state.pdf_input_key = 0
+if "pdf_upload_hashes" not in st.session_state:
+    st.session_state.pdf_upload_hashes = {}  # upload file_id -> content hash
+if "pdf_removed_uploads" not in st.session_state:
+    st.session_state.pdf_removed_uploads = set()  # upload file_ids removed from the index
+if "pdf_jobs" not in st.session_state:
+    st.session_state.pdf_jobs = {}  # upload file_id -> background ingest job id
+
+@st.cache_resource
+def get_document_stores() -> tuple:
+    """Process-wide PDF processor and vector store, created once rather than on every rerun"""
+    # Embedding shards live next to the text cache and are evicted with it; chunks are
+    # built from extracted text, so shards of another extractor version are rebuilt
+    store = VectorShardStore(PDF_CACHE_DIR, dict(embedding_signature(), extractor_version=EXTRACTOR_VERSION))
+    processor = PDFProcessor(on_evict=store.remove_shard)
+    return processor, store
+
+
+@st.cache_resource
+def get_ingest_worker() -> IngestWorker:
+    """Process-wide background ingestion worker, it keeps running across reruns and sessions"""
+    processor, store = get_document_stores()
+    return IngestWorker(processor, store)
+
 
-# Initialize PDF processor
-pdf_processor = PDFProcessor()
+pdf_processor, vector_store = get_document_stores()
+ingest_worker = get_ingest_worker()
+if "pdf_index" not in st.session_state:
+    st.session_state.pdf_index = RetrievalIndex(store=vector_store)
+
+
+def remove_pdf(filename: str):
+    """Drop a loaded PDF from the session and tombstone its chunks in the index"""
+    document = st.session_state.pdf_contents.pop(filename)
+    # The same content may also be loaded under another name
+    if not any(other['file_hash'] == document['file_hash'] for other in st.session_state.pdf_contents.values()):
+        st.session_state.pdf_index.remove_document(document['file_hash'])
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_ingest_progress():
+    """Poll this session's background jobs; a full rerun picks up the documents that finished"""
+    jobs = [ingest_worker.job(job_id) for job_id in st.session_state.pdf_jobs.values()]
+    jobs = [job for job in jobs if job]
+    for job in jobs:
+        if job['status'] == JOB_QUEUED:
+            st.progress(0.0, text=f"⏳ {job['filename']}: queued")
+        elif job['status'] == JOB_INDEXING:
+            st.progress(1.0, text=f"🔎 {job['filename']}: indexing")
+        elif job['status'] not in FINISHED_STATES:
+            fraction = job['pages_done'] / job['total_pages'] if job['total_pages'] else 0.0
+            st.progress(fraction, text=f"Processing {job['filename']}... page {job['pages_done']}/{job['total_pages']}")
+    if len(jobs) < len(st.session_state.pdf_jobs) or any(job['status'] in FINISHED_STATES for job in jobs):
+        st.rerun()
 
 # Header
 st.title("📚 PDF-Based AI Assistant")
@@ -190,52 +241,131 @@ with st.sidebar:
         help="Upload one or more PDF files to analyze"
     )
     
-    # Process uploaded files
-    if uploaded_files:
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+    # Uploads removed with the per-document button stay in the uploader, skip them
+    active_uploads = [
+        uploaded_file for uploaded_file in uploaded_files or []
+        if uploaded_file.file_id not in st.session_state.pdf_removed_uploads
+    ]
+    active_ids = {uploaded_file.file_id for uploaded_file in active_uploads}
+    
+    # Documents whose upload was removed from the uploader leave the index too
+    for filename, document in list(st.session_state.pdf_contents.items()):
+        if document['file_id'] not in active_ids:
+            remove_pdf(filename)
+    
+    loaded_ids = {document['file_id'] for document in st.session_state.pdf_contents.values()}
+    new_uploads = [uploaded_file for uploaded_file in active_uploads if uploaded_file.file_id not in loaded_ids]
+    
+    documents_to_index = []
+    
+    def load_document(filename: str, document: Dict):
+        # A new upload under a loaded name replaces that document
+        if filename in st.session_state.pdf_contents:
+            remove_pdf(filename)
+        st.session_state.pdf_contents[filename] = document
+        documents_to_index.append((document['file_hash'], filename, document['pages']))
+    
+    # Uploads seen before are loaded from the cache, new ones are queued for the background worker
+    for uploaded_file in new_uploads:
+        if uploaded_file.file_id in st.session_state.pdf_jobs:
+            continue
+        # Hash each upload once, reruns reuse the hash stored under its upload id
+        file_hash = st.session_state.pdf_upload_hashes.get(uploaded_file.file_id)
+        if file_hash is None:
+            file_hash = hash_upload(uploaded_file)
+            st.session_state.pdf_upload_hashes[uploaded_file.file_id] = file_hash
         
-        for i, uploaded_file in enumerate(uploaded_files):
-            status_text.text(f"Processing {uploaded_file.name}...")
-            
-            # Check if file is already processed
-            file_hash = pdf_processor.get_file_hash(uploaded_file)
-            cached_data = pdf_processor.load_cached_content(file_hash)
-            
-            if cached_data:
-                st.session_state.pdf_contents[uploaded_file.name] = cached_data['content']
-                status_text.text(f"✅ Loaded from cache: {uploaded_file.name}")
-            else:
-                # Extract text
-                extracted_text = pdf_processor.extract_text_from_pdf(uploaded_file)
-                if extracted_text:
-                    st.session_state.pdf_contents[uploaded_file.name] = extracted_text
-                    # Cache the content
-                    pdf_processor.cache_pdf_content(file_hash, extracted_text, uploaded_file.name)
-                    status_text.text(f"✅ Processed: {uploaded_file.name}")
-                else:
-                    status_text.text(f"❌ Failed to process: {uploaded_file.name}")
-            
-            progress_bar.progress((i + 1) / len(uploaded_files))
+        cached_data = pdf_processor.load_cached_content(file_hash)
+        if cached_data:
+            load_document(uploaded_file.name, {
+                'file_id': uploaded_file.file_id,
+                'file_hash': file_hash,
+                'extractor': cached_data['extractor'],
+                'pages': cached_data['pages'],
+                'stats': cached_data['stats']
+            })
+        else:
+            # Large uploads are spooled to disk and memory-mapped by the extraction workers
+            st.session_state.pdf_jobs[uploaded_file.file_id] = ingest_worker.submit(
+                uploaded_file.name, upload_source(uploaded_file), file_hash, uploaded_file.size
+            )
+    
+    # Collect finished jobs; documents become answerable while the rest are still processing
+    for file_id, job_id in list(st.session_state.pdf_jobs.items()):
+        job = ingest_worker.job(job_id)
+        if file_id not in active_ids:
+            # Removed while queued or processing
+            ingest_worker.cancel(job_id)
+            ingest_worker.forget(job_id)
+            del st.session_state.pdf_jobs[file_id]
+            continue
+        if job is None:
+            # Pruned before this session collected it, the upload is submitted again on the next run
+            del st.session_state.pdf_jobs[file_id]
+            continue
+        if job['status'] not in FINISHED_STATES:
+            continue
+        del st.session_state.pdf_jobs[file_id]
+        ingest_worker.forget(job_id)
         
-        status_text.text("✅ All files processed!")
-        st.success(f"Successfully processed {len(st.session_state.pdf_contents)} PDF files!")
+        result = job['result']
+        for page_number, error in (result['errors'] if result else []):
+            if page_number:
+                st.warning(f"Could not extract text from {job['filename']} page {page_number}: {error}")
+        if job['status'] == JOB_DONE:
+            if result['resumed_pages']:
+                st.info(f"Resumed {job['filename']}: {result['resumed_pages']} page(s) were already extracted")
+            load_document(job['filename'], {
+                'file_id': file_id,
+                'file_hash': result['file_hash'],
+                'extractor': result['extractor'],
+                'pages': result['pages'],
+                'stats': result['stats']
+            })
+        else:
+            # Not retried on every rerun; uploading the file again starts a new job
+            st.session_state.pdf_removed_uploads.add(file_id)
+            st.error(f"❌ Failed to process {job['filename']}: {job['error']}")
+    
+    # The background worker has written the embedding shards, so indexing only loads them
+    if documents_to_index:
+        st.session_state.pdf_index.add_documents(documents_to_index, extractors={
+            document['file_hash']: document['extractor'] for document in st.session_state.pdf_contents.values()
+        })
+        st.success(f"Loaded {len(documents_to_index)} PDF file(s)")
+    
+    if st.session_state.pdf_jobs:
+        show_ingest_progress()
     
     # Display loaded PDFs
     if st.session_state.pdf_contents:
         st.markdown("### 📋 Loaded Documents")
-        for filename, content in st.session_state.pdf_contents.items():
-            word_count = len(content.split())
-            st.markdown(f"""
-            <div class="pdf-card">
-                <strong>📄 {filename}</strong><br>
-                <small>{word_count:,} words extracted</small>
-            </div>
-            """, unsafe_allow_html=True)
+        for filename, document in list(st.session_state.pdf_contents.items()):
+            stats = document['stats']
+            card_col, remove_col = st.columns([5, 1])
+            with card_col:
+                st.markdown(f"""
+                <div class="pdf-card">
+                    <strong>📄 {filename}</strong><br>
+                    <small>{stats['words']:,} words extracted from {stats['pages']:,} pages
+                    with {document.get('extractor', 'pypdf2')}</small>
+                </div>
+                """, unsafe_allow_html=True)
+            with remove_col:
+                if st.button("✖", key=f"remove_pdf_{document['file_id']}", help=f"Remove {filename}"):
+                    st.session_state.pdf_removed_uploads.add(document['file_id'])
+                    remove_pdf(filename)
+                    st.rerun()
         
         # Clear all PDFs button
         if st.button("🗑️ Clear All PDFs", type="secondary"):
+            st.session_state.pdf_removed_uploads.update(
+                document['file_id'] for document in st.session_state.pdf_contents.values()
+            )
+            # Uploads still queued or processing are dropped too, their jobs are cancelled on the rerun
+            st.session_state.pdf_removed_uploads.update(st.session_state.pdf_jobs)
             st.session_state.pdf_contents = {}
+            st.session_state.pdf_index = RetrievalIndex(store=vector_store)
             st.session_state.pdf_chat_history = []
             st.session_state.pdf_input_key += 1
             st.rerun()
@@ -243,12 +373,13 @@ with st.sidebar:
     # Statistics
     if st.session_state.pdf_contents:
         st.markdown("### 📊 Document Statistics")
-        total_words = sum(len(content.split()) for content in st.session_state.pdf_contents.values())
-        total_chars = sum(len(content) for content in st.session_state.pdf_contents.values())
+        total_words = sum(document['stats']['words'] for document in st.session_state.pdf_contents.values())
+        total_chars = sum(document['stats']['chars'] for document in st.session_state.pdf_contents.values())
         
         st.markdown(f"""
         <div class="stats-card">
             <h4>{len(st.session_state.pdf_contents)} Documents</h4>
+            <p>{len(st.session_state.pdf_index):,} Indexed Chunks</p>
             <p>{total_words:,} Total Words</p>
             <p>{total_chars:,} Total Characters</p>
         </div>
@@ -330,6 +461,9 @@ else:
                 else:
                     with st.chat_message("assistant"):
                         st.write(message['content'])
+            stats_caption = format_chat_stats(st.session_state.get("pdf_chat_stats"))
+            if stats_caption:
+                st.caption(stats_caption)
         
         # Chat input
         with st.form(key="pdf_chat_form", clear_on_submit=True):
@@ -363,18 +497,23 @@ else:
         
         # Process question
         if submit_button and user_question and user_question.strip():
-            with st.spinner("🔍 Searching through your PDFs..."):
-                try:
+            with st.chat_message("user"):
+                st.write(user_question)
+            try:
+                # Stream the answer as it is generated
+                with st.chat_message("assistant"):
                     response, updated_history = get_pdf_based_response(
                         user_question,
-                        st.session_state.pdf_contents,
-                        st.session_state.pdf_chat_history
+                        st.session_state.pdf_index,
+                        st.session_state.pdf_chat_history,
+                        render=streamlit_renderer("pdf_chat_stats"),
+                        cache=get_response_cache()
                     )
-                    st.session_state.pdf_chat_history = updated_history
-                    st.session_state.pdf_input_key += 1
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"❌ Error: {str(e)}")
+                st.session_state.pdf_chat_history = updated_history
+                st.session_state.pdf_input_key += 1
+                st.rerun()
+            except Exception as e:
+                st.error(f"❌ Error: {str(e)}")
     
     with col2:
         # Quick actions and info
@@ -392,6 +531,9 @@ else:
         
         st.metric("Total Messages", total_messages)
         st.metric("Questions Asked", user_messages)
+        cache_stats = get_response_cache().stats()
+        st.metric("Answer Cache Hit Rate", f"{cache_stats['hit_rate']:.0%}",
+                  help=f"{cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} cached answers")
         
         # Tips
         st.markdown("### 💡 Tips")
@@ -417,3 +559,5 @@ st.markdown("""
 **Note:** This assistant only provides information based on the uploaded PDF documents. 
 For questions outside the scope of your documents, please consult other sources.
 """)
+
+render_performance_panel()
@@ -1,14 +1,13 @@
 import streamlit as st
 import sys
 import os
-from dotenv import load_dotenv
+import time
 
-#Load Environemtn Variable
-load_dotenv()
-
-#add the parent directory to the path to import utils
+#add the parent directory to the path to import utils (which also loads .env, once per process)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import get_openai_response
+from utils import complete_chat, replay_reply, streamlit_renderer, format_chat_stats
+from response_cache import get_response_cache, make_scope
+from instrumentation import render_performance_panel
 
 #Role-Based System Prompts 
 ROLE_PROMPTS = {
@@ -21,24 +20,31 @@ ROLE_PROMPTS = {
 }
 
 
-def get_role_response(prompt, chat_history, role):
-    """Get Response with role =-specific system prompt"""
-    messages = [{"role": "system", "content": ROLE_PROMPTS[role]}]
-    #Add Chat History
+def get_role_response(prompt, chat_history, role, render=None, cache=None):
+    """Get Response with role =-specific system prompt, streamed through render when given"""
+    #Repeated opening questions to the same role are answered from the cache,
+    #follow-ups depend on the conversation so they always go to the model
     if chat_history:
-        messages.extend(chat_history)
-
-    messages.append({"role": "user", "content": prompt})
+        cache = None
+    cache_scope = make_scope("role", ROLE_PROMPTS[role])
+    cached_reply = None
+    if cache is not None:
+        lookup_start = time.perf_counter()
+        cached_reply = cache.get(cache_scope, prompt)
+
+    if cached_reply is not None:
+        reply, _ = replay_reply(cached_reply, render, time.perf_counter() - lookup_start)
+    else:
+        messages = [{"role": "system", "content": ROLE_PROMPTS[role]}]
+        #Add Chat History
+        if chat_history:
+            messages.extend(chat_history)
 
-    from openai import OpenAI
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        messages.append({"role": "user", "content": prompt})
 
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages= messages
-    )
-
-    reply = response.choices[0].messages.content
+        reply, _ = complete_chat(messages, model="gpt-4", render=render)
+        if cache is not None and reply:
+            cache.put(cache_scope, prompt, reply)
 
     #Update Chat History
     update_history = chat_history if chat_history else []
@@ -101,7 +107,7 @@ with st.sidebar:
         st.session_state.role_chat_history = []
         st.session_state.selected_role = selected_role
         st.session_state.role_input_key += 1
-        st.rerun
+        st.rerun()
     
     #Display Current role info
     st.markdown(f"""
@@ -127,11 +133,13 @@ with st.sidebar:
         st.caption(describtion[:80] + "..." if len(describtion)>80 else describtion)
         st.markdown("---")
 
-        #Clear Conversation Button
-        if st.button("Clear Conversation", type="secondary"):
-            st.session_state.role_chat_history = []
-            st.session_state.role_input_key += 1
-            st.rerun()
+    #Clear Conversation Button
+    if st.button("Clear Conversation", type="secondary"):
+        st.session_state.role_chat_history = []
+        st.session_state.role_input_key += 1
+        st.rerun()
+
+render_performance_panel()
 
 #Main Chat Interface
 col1, col2 = st.columns([3, 1])
@@ -161,6 +169,9 @@ with col1:
             else:
                 with st.chat_message("assistant"):
                     st.write(message['content'])
+        stats_caption = format_chat_stats(st.session_state.get("role_chat_stats"))
+        if stats_caption:
+            st.caption(stats_caption)
     else:
         st.info(f"Hello! I am your {selected_role} assistant. How can i help you today")
 
@@ -172,31 +183,41 @@ with col1:
             key=f"role_input_{st.session_state.role_input_key}",
             height = 100
         )
+        submit_button = st.form_submit_button("Send")
 
     if submit_button and user_input and user_input.strip():
-        with st.spinner(f"....{selected_role} is thinking..."):
-            try:
+        with st.chat_message("user"):
+            st.write(user_input)
+        try:
+            #Stream the reply as it is generated
+            with st.chat_message("assistant"):
                 response, updated_history = get_role_response(
                     user_input,
                     st.session_state.role_chat_history,
-                    selected_role
+                    selected_role,
+                    render=streamlit_renderer("role_chat_stats"),
+                    cache=get_response_cache()
                 )
-                st.session_state.role_chat_history = updated_history
-                st.session_state.role_input_key += 1
-                st.rerun()
-            except Exception as e:
-                st.error(f"❌ Error: {str(e)}")
-                st.error("Please check your OpenAI API key and internet connection.")
+            st.session_state.role_chat_history = updated_history
+            st.session_state.role_input_key += 1
+            st.rerun()
+        except Exception as e:
+            st.error(f"❌ Error: {str(e)}")
+            st.error("Please check your OpenAI API key and internet connection.")
 
 with col2:
     st.markdown("Session Stats")
 
     total_messages = len(st.session_state.role_chat_history)
-    user_message = len(m for m in st.session_state.role_chat_history if m["role"] == "user")
+    user_message = len([m for m in st.session_state.role_chat_history if m["role"] == "user"])
 
     st.metric("Total Messages", total_messages)
     st.metric("Your Message", user_message)
 
+    cache_stats = get_response_cache().stats()
+    st.metric("Answer Cache Hit Rate", f"{cache_stats['hit_rate']:.0%}",
+              help=f"{cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} cached answers")
+
 
 
           
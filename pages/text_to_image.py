@@ -1,14 +1,15 @@
 import streamlit as st
-from openai import OpenAI
-import requests
-from PIL import Image
-import io
+import sys
 import os
-from datetime import datetime
-from dotenv import load_dotenv
 
-#Load Environment 
-load_dotenv()
+#add the parent directory to the path to import utils (which also loads .env, once per process)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import get_openai_client
+from image_cache import get_image_cache, make_request_key, fetch_image_bytes
+from instrumentation import render_performance_panel, span
+
+# Generated images, shared across reruns and sessions
+image_cache = get_image_cache()
 
 #Configure Page
 st.set_page_config(page_title="AI Image Generator Hub",
@@ -31,8 +32,8 @@ else:
     api_key = st.sidebar.text_input("OpenAI API Key", type="password", help="Enter Your OpenAI API Key")
 
 if api_key:
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
+    # Shared OpenAI client, reused across reruns
+    client = get_openai_client(api_key)
 
     #Image Generator Paramete
     st.sidebar.subheader("Generate Parameter")
@@ -117,26 +118,38 @@ with col1:
             st.error("Please Enter a text prompt")
         else:
             try:
-                with st.spinner("Generating Image...This may take a few seconds or while"):
-                    # Prepare parameters for the API call
-                    params = {
-                        "prompt": prompt,
-                        "model": model,
-                        "size": size,
-                        "n": n_images
-                    }
-                    
-                    # Add quality and style only for DALL-E 3
-                    if model == "dall-e-3":
-                        params["quality"] = quality
-                        params["style"] = style
-                    
-                    response = client.images.generate(**params)
-
-                    # Store Generated Images in session state
-                    st.session_state.generated_images = response.data
-                    st.session_state.current_prompt = prompt
-                    st.success("Image Generated Successfully")
+                request_key = make_request_key(prompt, model, size, quality, style, n_images)
+                content_hashes = image_cache.lookup_request(request_key)
+                if content_hashes:
+                    st.success("Served from the image cache")
+                else:
+                    with st.spinner("Generating Image...This may take a few seconds or while"):
+                        # Prepare parameters for the API call
+                        params = {
+                            "prompt": prompt,
+                            "model": model,
+                            "size": size,
+                            "n": n_images,
+                            # Image bytes come back inline, so there is nothing to download
+                            "response_format": "b64_json"
+                        }
+
+                        # Add quality and style only for DALL-E 3
+                        if model == "dall-e-3":
+                            params["quality"] = quality
+                            params["style"] = style
+
+                        with span("openai.image", model=model, size=size, n=n_images):
+                            response = client.images.generate(**params)
+
+                        content_hashes = [image_cache.store_image(fetch_image_bytes(image_data))
+                                          for image_data in response.data]
+                        image_cache.store_request(request_key, content_hashes)
+                        st.success("Image Generated Successfully")
+
+                # Store content hashes of the generated images in session state
+                st.session_state.generated_images = content_hashes
+                st.session_state.current_prompt = prompt
             except Exception as e:
                 st.error(f"Error Generating Image: {str(e)}")
 
@@ -145,27 +158,25 @@ with col2:
 
     #Display Generated Images
     if hasattr(st.session_state, 'generated_images') and st.session_state.generated_images:
-        for i, image_data in enumerate(st.session_state.generated_images):
+        for i, content_hash in enumerate(st.session_state.generated_images):
             try:
-                #Download and Display Image
-                image_response = requests.get(image_data.url)
-                image = Image.open(io.BytesIO(image_response.content))
+                # Served from memory or disk; never re-downloaded or re-encoded on rerun
+                image_bytes = image_cache.load(content_hash)
+                if image_bytes is None:
+                    st.warning(f"Image {i+1} is no longer cached, please generate it again")
+                    continue
 
-                st.image(image, caption=f"Generated Image {i+1}", use_column_width=True)
+                st.image(image_bytes, caption=f"Generated Image {i+1}", use_column_width=True)
 
                 #Download Button
-                img_buffer = io.BytesIO()
-                image.save(img_buffer, format='PNG')
-                img_buffer.seek(0)
-
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"generated_image_{timestamp}_{i+1}.png"
+                filename = f"generated_image_{content_hash[:12]}.png"
 
                 st.download_button(
                     label=f"Download Image",
-                    data=img_buffer.getvalue(),
+                    data=image_bytes,
                     file_name=filename,
-                    mime="image/png"
+                    mime="image/png",
+                    key=f"download_{i}_{content_hash[:12]}"
                 )
 
                 #show prompt used 
@@ -175,5 +186,7 @@ with col2:
                 st.error(f"Error Display Image {i+1}: {str(e)}")
     else:
         st.info("Generated Images will appear here")
+
+render_performance_panel()
         
 
@@ -0,0 +1,319 @@
+import hashlib
+import importlib
+import importlib.util
+import io
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+from instrumentation import span, traced
+
+# Bump whenever extraction output changes, cached documents from other versions are discarded.
+# The backend that extracted a document is recorded with it separately.
+EXTRACTOR_VERSION = "pages-2"
+
+# Extraction backends: name -> module providing a pypdf-style PdfReader
+EXTRACTOR_BACKENDS = {
+    'pypdf': "pypdf",
+    'pypdf2': "PyPDF2",
+}
+
+# Backend to use, or "auto" to measure the installed ones on the first document and keep the fastest
+PDF_EXTRACTOR = os.getenv("PDF_EXTRACTOR", "auto")
+
+# Pages extracted per backend when measuring them
+CALIBRATION_PAGES = 8
+
+# Pages extracted by one worker task
+PAGES_PER_TASK = 25
+
+# Worker processes are started by a fork server (spawned where there is none), never forked directly from
+# the Streamlit server, whose other threads may hold locks that a forked child would inherit locked
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Uploads larger than this are spooled to a temporary file that workers memory-map
+SPOOL_THRESHOLD = int(os.getenv("PDF_SPOOL_THRESHOLD_MB", "8")) * 1024 * 1024
+
+# Block size for incremental hashing and spooling
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# A PDF to extract: its bytes, or the path of a file holding them
+PdfSource = Union[bytes, str]
+
+
+def hash_upload(upload) -> str:
+    """MD5 of a file-like upload, fed in fixed-size blocks rather than one copy of the whole file"""
+    digest = hashlib.md5()
+    upload.seek(0)
+    # Block reads, unlike getbuffer(), never make an in-memory upload copy its whole buffer
+    for block in iter(lambda: upload.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+    upload.seek(0)
+    return digest.hexdigest()
+
+
+def upload_source(upload, spool_threshold: int = SPOOL_THRESHOLD) -> PdfSource:
+    """The PdfSource for an upload: its bytes when small, a spooled temporary file when large.
+
+    Worker tasks then receive a path instead of a pickled copy of the file each.
+    Remove spooled files with release_source() once ingestion is done.
+    """
+    size = upload.seek(0, io.SEEK_END)
+    upload.seek(0)
+    if size <= spool_threshold:
+        # getvalue() returns the bytes an unmodified BytesIO was created from, without copying
+        return upload.getvalue() if hasattr(upload, "getvalue") else upload.read()
+    fd, path = tempfile.mkstemp(prefix="upload_", suffix=".pdf")
+    with os.fdopen(fd, 'wb') as f:
+        shutil.copyfileobj(upload, f, HASH_BLOCK_SIZE)
+    upload.seek(0)
+    return path
+
+
+def release_source(source: PdfSource):
+    """Remove a file spooled by upload_source()"""
+    if isinstance(source, str) and os.path.exists(source):
+        os.remove(source)
+
+
+@contextmanager
+def open_pdf(source: PdfSource, extractor: str = "pypdf2"):
+    """PdfReader over PDF bytes, or over a memory-mapped file so its pages are read from the page cache"""
+    reader_class = importlib.import_module(EXTRACTOR_BACKENDS[extractor]).PdfReader
+
+    if isinstance(source, str):
+        with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield reader_class(mapped)
+    else:
+        yield reader_class(io.BytesIO(source))
+
+
+def count_pages(source: PdfSource, extractor: str = "pypdf2") -> int:
+    """Return the number of pages in a PDF"""
+    with open_pdf(source, extractor) as reader:
+        return len(reader.pages)
+
+
+def available_extractors() -> List[str]:
+    """Names of the backends whose module is installed"""
+    return [name for name, module in EXTRACTOR_BACKENDS.items() if importlib.util.find_spec(module)]
+
+
+def measure_extractor(extractor: str, source: PdfSource, max_pages: int = CALIBRATION_PAGES) -> float:
+    """Pages per second of a backend on the first pages of a PDF, opening included; 0 if it fails"""
+    start = time.perf_counter()
+    try:
+        with open_pdf(source, extractor) as reader:
+            pages = min(len(reader.pages), max_pages)
+            for page_index in range(pages):
+                reader.pages[page_index].extract_text()
+    except Exception:
+        return 0.0
+    return pages / max(time.perf_counter() - start, 1e-9)
+
+
+# Pages per second measured by select_extractor(), by backend
+extractor_rates: Dict[str, float] = {}
+_selected_extractor = None
+_selection_lock = threading.Lock()
+
+
+def select_extractor(source: Optional[PdfSource] = None, extractor: str = PDF_EXTRACTOR) -> str:
+    """Resolve "auto" to the fastest installed backend, measured once per process on source.
+
+    A source no backend can read (every rate 0) is not measured on, the next
+    source is tried instead.
+    """
+    global _selected_extractor
+    if extractor != "auto":
+        return extractor
+    with _selection_lock:
+        if _selected_extractor is None:
+            available = available_extractors()
+            if not available:
+                raise RuntimeError("No PDF extraction backend is installed, install pypdf or PyPDF2")
+            if len(available) == 1 or source is None:
+                return available[0]
+            rates = {name: measure_extractor(name, source) for name in available}
+            extractor_rates.update(rates)
+            if not any(rates.values()):
+                return available[0]
+            _selected_extractor = max(available, key=lambda name: rates[name])
+        return _selected_extractor
+
+
+def make_page_record(page_number: int, text: str) -> Dict:
+    """Build the record stored for every extracted page"""
+    return {
+        'page': page_number,
+        'text': text,
+        'chars': len(text),
+        'words': len(text.split())
+    }
+
+
+def summarize_pages(pages: List[Dict]) -> Dict:
+    """Document statistics computed once from its page records"""
+    return {
+        'pages': len(pages),
+        'words': sum(page['words'] for page in pages),
+        'chars': sum(page['chars'] for page in pages)
+    }
+
+
+def iter_page_records(reader, start: int = 0, end: Optional[int] = None) -> Iterator[tuple]:
+    """Yield (page_record, error) for pages [start, end) of an open PdfReader"""
+    if end is None:
+        end = len(reader.pages)
+    for page_index in range(start, end):
+        try:
+            text = reader.pages[page_index].extract_text() or ""
+            yield make_page_record(page_index + 1, text), None
+        except Exception as e:
+            yield make_page_record(page_index + 1, ""), str(e)
+
+
+def extract_page_range(source: PdfSource, start: int, end: int, extractor: str = "pypdf2") -> List[tuple]:
+    """Extract pages [start, end) of a PDF as (page_record, error) tuples.
+
+    Runs in a worker process, so failures are returned rather than shown.
+    """
+    with open_pdf(source, extractor) as reader:
+        return list(iter_page_records(reader, start, end))
+
+
+@traced("pdf.ingest")
+def ingest_pdfs(files: List[tuple], max_workers: Optional[int] = None,
+                pages_per_task: int = PAGES_PER_TASK,
+                on_progress: Optional[Callable[[str, int, int, float], None]] = None,
+                segment_cache=None,
+                on_segment: Optional[Callable[[str, str, List[Dict]], None]] = None,
+                extractor: str = PDF_EXTRACTOR) -> List[Dict]:
+    """Extract text from several PDFs in parallel.
+
+    Args:
+        files (list): (filename, source, file_hash) tuples, source being the PDF
+            bytes or the path of a file holding them (see upload_source)
+        max_workers (int): Size of the process pool, defaults to the CPU count
+        pages_per_task (int): Pages handled by one worker task
+        on_progress (callable): Called in the calling thread as
+            on_progress(filename, pages_done, total_pages, overall_fraction)
+        segment_cache (DocumentCache): Stores each finished page range and
+            supplies the ranges already extracted, so an interrupted run resumes
+        on_segment (callable): Called in the calling thread as
+            on_segment(filename, file_hash, page_records) whenever pages finish,
+            so later stages can start before the whole document is done
+        extractor (str): Backend name from EXTRACTOR_BACKENDS, or "auto" to
+            use the fastest one as measured on the first file
+
+    Returns:
+        list: One dict per input file, in input order, with keys
+            'filename', 'file_hash', 'pages' (page records in page order),
+            'stats', 'extractor', 'resumed_pages' (pages reused from segment_cache) and
+            'errors' ([(page_number, message)], page_number 0 for errors that
+            affect the whole file)
+    """
+    extractor = select_extractor(files[0][1] if files else None, extractor)
+    results = []
+    tasks = []
+    resumed = []
+    for filename, source, file_hash in files:
+        result = {'filename': filename, 'file_hash': file_hash, 'extractor': extractor, 'errors': []}
+        try:
+            total = count_pages(source, extractor)
+        except Exception as e:
+            result['errors'].append((0, str(e)))
+            total = 0
+        result['pages'] = [None] * total
+        result['done'] = 0
+        results.append(result)
+        doc_index = len(results) - 1
+
+        # Page ranges finished by an earlier, interrupted run are reused
+        covered = [False] * total
+        segments = segment_cache.load_segments(file_hash, extractor) if segment_cache and total else []
+        for start, end, page_results in segments:
+            if end <= total:
+                resumed.append((doc_index, page_results))
+                covered[start:end] = [True] * (end - start)
+        result['resumed_pages'] = sum(covered)
+
+        start = 0
+        while start < total:
+            if covered[start]:
+                start += 1
+                continue
+            end = start + 1
+            while end < total and not covered[end] and end - start < pages_per_task:
+                end += 1
+            tasks.append((doc_index, source, start, end))
+            start = end
+
+    total_pages = sum(len(result['pages']) for result in results)
+    pages_done = 0
+
+    def collect(doc_index, page_results, segment=None):
+        nonlocal pages_done
+        result = results[doc_index]
+        if segment_cache and segment:
+            segment_cache.store_segment(result['file_hash'], segment[0], segment[1], page_results, extractor)
+        new_records = []
+        for record, error in page_results:
+            # Stored segments may overlap when pages_per_task changed between runs
+            if result['pages'][record['page'] - 1] is not None:
+                continue
+            result['pages'][record['page'] - 1] = record
+            new_records.append(record)
+            if error:
+                result['errors'].append((record['page'], error))
+        result['done'] += len(new_records)
+        pages_done += len(new_records)
+        if on_segment and new_records:
+            on_segment(result['filename'], result['file_hash'], new_records)
+        if on_progress:
+            on_progress(result['filename'], result['done'], len(result['pages']),
+                        pages_done / total_pages if total_pages else 1.0)
+
+    for doc_index, page_results in resumed:
+        collect(doc_index, page_results)
+
+    # Timed here rather than in extract_page_range, whose spans would be recorded in the worker processes
+    with span("pdf.extract", extractor=extractor, tasks=len(tasks),
+              pages=sum(end - start for _, _, start, end in tasks)):
+        if len(tasks) == 1:
+            # Not worth starting a process pool for a single small document
+            doc_index, source, start, end = tasks[0]
+            collect(doc_index, extract_page_range(source, start, end, extractor), (start, end))
+        elif tasks:
+            workers = max_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks)),
+                                     mp_context=multiprocessing.get_context(POOL_START_METHOD)) as executor:
+                futures = {
+                    executor.submit(extract_page_range, source, start, end, extractor): (doc_index, start, end)
+                    for doc_index, source, start, end in tasks
+                }
+                for future in as_completed(futures):
+                    doc_index, start, end = futures[future]
+                    try:
+                        page_results = future.result()
+                    except Exception as e:
+                        # A crashed worker's pages are reported, not stored, so the next run retries them
+                        collect(doc_index, [(make_page_record(page_index + 1, ""), str(e))
+                                            for page_index in range(start, end)])
+                        continue
+                    collect(doc_index, page_results, (start, end))
+
+    for result in results:
+        result['errors'].sort()
+        # Pages are stored by index, so they are in page order regardless
+        # of the order the workers finished in
+        result['stats'] = summarize_pages(result['pages'])
+        del result['done']
+    return results
@@ -0,0 +1,109 @@
+import time
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from instrumentation import traced
+from transitions import TRANSITIONS, TransitionRenderer
+
+# Container, codec candidates (tried in order), the codecs browsers can play and MIME type per output
+# format. The first format is the default: pip opencv-python builds cannot encode H.264, so their MP4
+# files use MPEG-4 Part 2 (mp4v), which browsers do not play.
+VIDEO_FORMATS = {
+    "WebM (VP9)": {"extension": ".webm", "fourccs": ["VP90", "VP80"], "playable": ["VP90", "VP80"],
+                   "mime": "video/webm"},
+    "MP4 (H.264 or MPEG-4)": {"extension": ".mp4", "fourccs": ["avc1", "H264", "mp4v"],
+                              "playable": ["avc1", "H264"], "mime": "video/mp4"},
+    "AVI (MJPEG)": {"extension": ".avi", "fourccs": ["MJPG"], "playable": [], "mime": "video/x-msvideo"}
+}
+DEFAULT_VIDEO_FORMAT = next(iter(VIDEO_FORMATS))
+
+DEFAULT_FPS = 30
+DEFAULT_TRANSITION_SECONDS = 1.0
+DEFAULT_TRANSITION = TRANSITIONS[0]
+
+
+def pil_to_bgr(image, size=None) -> np.ndarray:
+    """Convert a PIL image to the BGR uint8 array OpenCV writes"""
+    import cv2
+
+    rgb = np.asarray(image.convert("RGB"))
+    if size is not None and (rgb.shape[1], rgb.shape[0]) != size:
+        rgb = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+
+def open_video_writer(path: str, fourccs: List[str], fps: int, size: tuple) -> tuple:
+    """Open a VideoWriter with the first codec this OpenCV build supports"""
+    import cv2
+
+    for fourcc in fourccs:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened():
+            return writer, fourcc
+        writer.release()
+    raise RuntimeError(f"None of the codecs {', '.join(fourccs)} are available in this OpenCV build")
+
+
+def iter_progression_frames(stage_images: List[np.ndarray], fps: int, stage_seconds: float,
+                            transition_seconds: float, transition: str = DEFAULT_TRANSITION,
+                            renderer: TransitionRenderer = None) -> Iterator[np.ndarray]:
+    """Yield output frames: each stage is held, then transitions into the next.
+
+    Every stage occupies stage_seconds, the transition taking the last
+    transition_seconds of it. Transition frames live in the renderer's reused
+    buffers, so callers must consume each frame before asking for the next.
+    """
+    renderer = renderer or TransitionRenderer()
+    stage_frames = max(1, round(stage_seconds * fps))
+    transition_frames = min(round(transition_seconds * fps), stage_frames - 1)
+
+    for index, current in enumerate(stage_images):
+        is_last = index == len(stage_images) - 1
+        hold_frames = stage_frames if is_last else stage_frames - transition_frames
+        for _ in range(hold_frames):
+            yield current
+        if is_last:
+            break
+
+        yield from renderer.render(transition, current, stage_images[index + 1], transition_frames)
+
+
+@traced("video.encode")
+def encode_progression_video(frames: List[Dict], output_path: str, stage_seconds: float,
+                             fps: int = DEFAULT_FPS, transition_seconds: float = DEFAULT_TRANSITION_SECONDS,
+                             video_format: str = DEFAULT_VIDEO_FORMAT, transition: str = DEFAULT_TRANSITION) -> Dict:
+    """Encode progression frames (as produced by generate_disease_progression_frames) into a video file.
+
+    Frames are streamed to the writer one at a time; only the stage images are
+    kept in memory. Returns the path, MIME type, codec used, whether browsers
+    can play it and encode stats.
+    """
+    if not frames:
+        raise ValueError("No progression frames to encode")
+    settings = VIDEO_FORMATS[video_format]
+
+    ordered = sorted(frames, key=lambda frame: frame['stage_number'])
+    size = ordered[0]['image'].size
+    stage_images = [pil_to_bgr(frame['image'], size) for frame in ordered]
+
+    start_time = time.perf_counter()
+    writer, fourcc = open_video_writer(output_path, settings["fourccs"], fps, size)
+    frames_written = 0
+    try:
+        for frame in iter_progression_frames(stage_images, fps, stage_seconds, transition_seconds, transition):
+            writer.write(frame)
+            frames_written += 1
+    finally:
+        writer.release()
+
+    return {
+        'path': output_path,
+        'mime': settings["mime"],
+        'codec': fourcc,
+        'browser_playable': fourcc in settings["playable"],
+        'transition': transition,
+        'frames_written': frames_written,
+        'duration': frames_written / fps,
+        'encode_time': time.perf_counter() - start_time
+    }
@@ -0,0 +1,156 @@
+import os
+from typing import Dict, List, Optional
+
+from chat_history import count_message_tokens, count_tokens
+from retrieval import format_context
+
+# Context window (prompt + completion tokens) by model name prefix, the longest matching prefix wins
+MODEL_CONTEXT_WINDOWS = {
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4o': 128000,
+    'gpt-3.5-turbo': 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Every reply is primed with a few tokens of its own (<|start|>assistant<|message|>)
+REPLY_PRIMING_TOKENS = 3
+
+# Cap on excerpt tokens even when the window has more room, past this more context adds cost, not answers
+DEFAULT_EXCERPT_BUDGET = int(os.getenv("PDF_CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Share of the room left after the fixed prompt and the answer that chat history may take
+HISTORY_SHARE = 0.3
+
+# Chunks sharing at least this many boundary words with a packed excerpt of the same page are merged into it
+MIN_OVERLAP_WORDS = 5
+
+
+def context_window(model: str) -> int:
+    matches = [name for name in MODEL_CONTEXT_WINDOWS if model.startswith(name)]
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+
+def merge_overlap(first: List[str], second: List[str]) -> Optional[List[str]]:
+    """first + second with their shared boundary words once, or None if first does not end with second's start"""
+    for size in range(min(len(first), len(second)), MIN_OVERLAP_WORDS - 1, -1):
+        if first[-size:] == second[:size]:
+            return first + second[size:]
+    return None
+
+
+def pack_excerpts(chunks: List[Dict], budget: int, model: str = "gpt-4") -> List[Dict]:
+    """Greedily pack chunks, best first, into at most budget tokens of cited excerpts.
+
+    Chunks already contained in a packed excerpt are skipped, and chunks that
+    overlap one from the same page are merged into it, so shared words are
+    only paid for once. A chunk too large for the remaining room is skipped
+    while smaller, lower ranked ones may still fit.
+    """
+    separator_tokens = count_tokens("\n\n", model)
+    excerpts = []
+    used = 0
+    for chunk in chunks:
+        words = chunk['text'].split()
+        if not words:
+            continue
+        text = " ".join(words)
+
+        merged = None
+        target = None
+        for excerpt in excerpts:
+            if f" {text} " in f" {excerpt['text']} ":
+                target = excerpt
+                break
+            if excerpt['filename'] == chunk['filename'] and excerpt['page'] == chunk['page']:
+                merged = merge_overlap(excerpt['words'], words) or merge_overlap(words, excerpt['words'])
+                if merged:
+                    target = excerpt
+                    break
+
+        if target is not None:
+            if merged:
+                candidate = dict(target, words=merged, text=" ".join(merged))
+                tokens = count_tokens(format_context([candidate]), model)
+                if used - target['tokens'] + tokens <= budget:
+                    used += tokens - target['tokens']
+                    target.update(candidate, tokens=tokens)
+            continue
+
+        excerpt = {'filename': chunk['filename'], 'page': chunk['page'], 'score': chunk.get('score'),
+                   'words': words, 'text': text}
+        excerpt['tokens'] = count_tokens(format_context([excerpt]), model)
+        cost = excerpt['tokens'] + (separator_tokens if excerpts else 0)
+        if used + cost <= budget:
+            excerpts.append(excerpt)
+            used += cost
+    return excerpts
+
+
+def fit_history(history: List[Dict], budget: int, model: str = "gpt-4") -> List[Dict]:
+    """The most recent messages of history whose tokens fit in budget"""
+    kept = []
+    used = 0
+    for message in reversed(history or []):
+        tokens = count_message_tokens(message, model)
+        if used + tokens > budget:
+            break
+        kept.append(message)
+        used += tokens
+    kept.reverse()
+    return kept
+
+
+def count_request_tokens(messages: List[Dict], model: str = "gpt-4") -> int:
+    """Exact prompt tokens of a chat request"""
+    return sum(count_message_tokens(message, model) for message in messages) + REPLY_PRIMING_TOKENS
+
+
+def build_messages(system_template: str, question: str, chunks: List[Dict], history: Optional[List[Dict]] = None,
+                   model: str = "gpt-4", answer_tokens: int = 1000,
+                   excerpt_budget: int = DEFAULT_EXCERPT_BUDGET) -> Dict:
+    """Assemble a grounded chat request that is guaranteed to fit the model's context window.
+
+    system_template contains "{context}", replaced by the packed excerpts.
+    Room is reserved for the answer first, then up to HISTORY_SHARE of what
+    remains for the most recent history, and the excerpts get the rest (at
+    most excerpt_budget). The finished request is counted exactly and the
+    lowest ranked excerpts are dropped if tokenizer boundary effects push it
+    over.
+
+    Returns:
+        dict: 'messages', 'excerpts' (packed, best first), 'prompt_tokens',
+            'history_messages' (kept) and 'dropped_history' (oldest left out)
+    """
+    limit = context_window(model) - answer_tokens
+    question_message = {"role": "user", "content": question}
+    fixed_tokens = count_request_tokens(
+        [{"role": "system", "content": system_template.replace("{context}", "")}, question_message], model
+    )
+    available = limit - fixed_tokens
+    if available < 0:
+        raise ValueError(f"The question is too long for {model}: {fixed_tokens} prompt tokens, "
+                         f"{limit} available after reserving {answer_tokens} for the answer")
+
+    kept_history = fit_history(history, int(available * HISTORY_SHARE), model)
+    history_tokens = sum(count_message_tokens(message, model) for message in kept_history)
+    excerpts = pack_excerpts(chunks, min(excerpt_budget, available - history_tokens), model)
+
+    while True:
+        context = "\n\n".join(format_context([excerpt]) for excerpt in excerpts)
+        messages = [{"role": "system", "content": system_template.replace("{context}", context)}]
+        messages.extend(kept_history)
+        messages.append(question_message)
+        prompt_tokens = count_request_tokens(messages, model)
+        if prompt_tokens <= limit or not excerpts:
+            break
+        excerpts.pop()
+
+    return {
+        'messages': messages,
+        'excerpts': excerpts,
+        'prompt_tokens': prompt_tokens,
+        'history_messages': len(kept_history),
+        'dropped_history': len(history or []) - len(kept_history)
+    }
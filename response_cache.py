@@ -0,0 +1,201 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "response_cache"
+
+# Cosine similarity above which two questions are treated as the same
+SIMILARITY_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.92"))
+
+# Entries older than this are never served
+DEFAULT_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_HOURS", "168")) * 3600
+
+# Least recently used entries beyond this count are evicted
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+
+def make_scope(*parts: str) -> str:
+    """Hash everything besides the question that the answer depends on"""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class SemanticResponseCache:
+    """Disk-backed cache of model replies keyed by scope and question meaning.
+
+    A scope identifies what the answer depends on besides the question (the
+    document set, role or system prompt). Within a scope, a question hits when
+    its normalized text matches exactly or its embedding is at least
+    ``threshold`` cosine-similar to a cached question. Callers only use it for
+    the first turn of a conversation, whose answer does not depend on history.
+
+    The cache is optional: numpy and the embedding model are loaded on the
+    first lookup, and any failure there is logged and treated as a miss so the
+    model still answers.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR,
+                 embed_fn: Optional[Callable[[List[str]], "np.ndarray"]] = None,
+                 threshold: float = SIMILARITY_THRESHOLD, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "responses.sqlite")
+        # The embedding computed by a missed get() is reused by the following put()
+        self._last_embedding = None
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    scope TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope, question)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _embed(self, question: str) -> "np.ndarray":
+        import numpy as np
+
+        if self.embed_fn is None:
+            # Loads sentence-transformers, so only once the cache is actually used
+            from retrieval import embed_texts
+            self.embed_fn = embed_texts
+        vector = np.asarray(self.embed_fn([question])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _count(self, conn: sqlite3.Connection, name: str):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def _hit(self, conn: sqlite3.Connection, entry_id: int):
+        conn.execute(
+            "UPDATE responses SET last_access = ?, hits = hits + 1 WHERE id = ?",
+            (time.time(), entry_id)
+        )
+        self._count(conn, "hits")
+
+    def get(self, scope: str, question: str) -> Optional[str]:
+        """Return a cached reply for the question, or None (also when the lookup fails)"""
+        try:
+            return self._get(scope, question)
+        except Exception:
+            logger.warning("Response cache lookup failed, treating it as a miss", exc_info=True)
+            self._last_embedding = None
+            return None
+
+    def put(self, scope: str, question: str, response: str):
+        """Store a reply and evict expired and least recently used entries; failures are only logged"""
+        try:
+            self._put(scope, question, response)
+        except Exception:
+            logger.warning("Response cache store failed", exc_info=True)
+
+    def _get(self, scope: str, question: str) -> Optional[str]:
+        import numpy as np
+
+        normalized = normalize_question(question)
+        min_created = time.time() - self.ttl_seconds
+        self._last_embedding = None
+
+        with closing(self._connect()) as conn, conn:
+            # Exact repeats don't need an embedding
+            row = conn.execute(
+                "SELECT id, response FROM responses WHERE scope = ? AND question = ? AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (scope, normalized, min_created)
+            ).fetchone()
+            if row:
+                self._hit(conn, row[0])
+                return row[1]
+
+            rows = conn.execute(
+                "SELECT id, embedding, response FROM responses WHERE scope = ? AND created_at >= ?",
+                (scope, min_created)
+            ).fetchall()
+            query = self._embed(normalized)
+            self._last_embedding = (normalized, query)
+            if rows:
+                matrix = np.stack([np.frombuffer(embedding, dtype=np.float32) for _, embedding, _ in rows])
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._hit(conn, rows[best][0])
+                    return rows[best][2]
+
+            self._count(conn, "misses")
+        return None
+
+    def _put(self, scope: str, question: str, response: str):
+        import numpy as np
+
+        normalized = normalize_question(question)
+        if self._last_embedding and self._last_embedding[0] == normalized:
+            embedding = self._last_embedding[1]
+        else:
+            embedding = self._embed(normalized)
+
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO responses (scope, question, embedding, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, normalized, embedding.astype(np.float32).tobytes(), response, now, now)
+            )
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM responses WHERE id IN ("
+                "SELECT id FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and hit rate since the cache was created"""
+        with closing(self._connect()) as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'entries': entries,
+            'hit_rate': hits / lookups if lookups else 0.0
+        }
+
+
+@lru_cache(maxsize=None)
+def get_response_cache(cache_dir: str = DEFAULT_CACHE_DIR) -> SemanticResponseCache:
+    """Process-wide response cache"""
+    return SemanticResponseCache(cache_dir)
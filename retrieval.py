@@ -0,0 +1,315 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from bm25 import BM25Index, BM25Shard, reciprocal_rank_fusion
+from instrumentation import traced
+from vector_store import VectorShardStore
+
+# Sentence-transformers model used for chunk and question embeddings
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Chunking parameters (in words)
+CHUNK_WORDS = 200
+CHUNK_OVERLAP_WORDS = 40
+
+# Number of chunks sent to the model for each question
+DEFAULT_TOP_K = 6
+
+# Each retriever contributes this many times top_k candidates to rank fusion
+FUSION_CANDIDATES = 4
+
+# Reciprocal rank fusion constant, the usual 60 damps the influence of top ranks
+RRF_K = 60
+
+# Removed documents stay in the index as tombstones until they pass this fraction of its chunks
+COMPACT_DEAD_FRACTION = 0.25
+
+_embedding_model = None
+
+
+def chunk_document(filename: str, pages: List[Dict], chunk_words: int = CHUNK_WORDS,
+                   overlap_words: int = CHUNK_OVERLAP_WORDS) -> List[Dict]:
+    """Split a document's page records into overlapping word windows that never cross a page boundary"""
+    step = max(chunk_words - overlap_words, 1)
+    chunks = []
+    for page in pages:
+        words = page['text'].split()
+        for start in range(0, len(words), step):
+            window = words[start:start + chunk_words]
+            chunks.append({
+                'filename': filename,
+                'page': page['page'],
+                'text': " ".join(window)
+            })
+            if start + chunk_words >= len(words):
+                break
+    return chunks
+
+
+def get_embedding_model():
+    """Load the sentence-transformers model once per process"""
+    global _embedding_model
+    if _embedding_model is None:
+        from sentence_transformers import SentenceTransformer
+        _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _embedding_model
+
+
+@traced("embed")
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts as L2-normalised float32 vectors"""
+    model = get_embedding_model()
+    embeddings = model.encode(
+        texts,
+        batch_size=64,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    )
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+
+def embedding_signature() -> Dict:
+    """Settings that must match for stored embeddings to be reused"""
+    return {
+        'model': EMBEDDING_MODEL_NAME,
+        'chunk_words': CHUNK_WORDS,
+        'chunk_overlap_words': CHUNK_OVERLAP_WORDS
+    }
+
+
+class PipelinedEmbedder:
+    """Chunks and embeds page segments on a background thread while extraction continues.
+
+    Chunks never cross page boundaries, so a document's chunks are its
+    segments' chunks concatenated in page order.
+    """
+
+    def __init__(self, embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None):
+        self.embed_fn = embed_fn or embed_texts
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self._segments: Dict[str, List[tuple]] = {}  # doc_id -> [(first page, future)]
+
+    def _embed(self, filename: str, pages: List[Dict]) -> tuple:
+        chunks = chunk_document(filename, pages)
+        return chunks, self.embed_fn([chunk['text'] for chunk in chunks]) if chunks else None
+
+    def submit(self, doc_id: str, filename: str, pages: List[Dict]):
+        """Queue a run of finished pages; each page of a document must be submitted once"""
+        future = self._executor.submit(self._embed, filename, pages)
+        self._segments.setdefault(doc_id, []).append((pages[0]['page'], future))
+
+    def result(self, doc_id: str) -> Optional[tuple]:
+        """Wait for a document's segments and return its (chunks, embeddings), or None if none were submitted"""
+        segments = sorted(self._segments.pop(doc_id, []), key=lambda segment: segment[0])
+        if not segments:
+            return None
+        parts = [future.result() for _, future in segments]
+        chunks = [chunk for part_chunks, _ in parts for chunk in part_chunks]
+        vectors = [embeddings for _, embeddings in parts if embeddings is not None]
+        return chunks, np.concatenate(vectors, axis=0) if vectors else None
+
+    def close(self):
+        """Drop segments that were never collected"""
+        self._segments.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RetrievalIndex:
+    """Hybrid index over the chunks of all loaded PDFs.
+
+    Dense FAISS inner-product search and BM25 keyword search run over the same
+    chunks and are fused with reciprocal rank fusion, so exact codes, drug
+    names and section numbers are found even when embeddings miss them.
+
+    Documents are added and removed incrementally. Removing one only marks
+    its chunks dead; the indexes are compacted once enough chunks are dead.
+    """
+
+    def __init__(self, embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 store: Optional[VectorShardStore] = None):
+        self.embed_fn = embed_fn or embed_texts
+        self.store = store
+        self.index = None
+        self.sparse = BM25Index()
+        self.chunks: List[Dict] = []
+        self.alive = np.zeros(0, dtype=bool)
+        # Live documents: doc_id -> (first chunk id, chunk count)
+        self.documents: Dict[str, tuple] = {}
+
+    def __len__(self):
+        """Number of live chunks"""
+        return sum(count for _, count in self.documents.values())
+
+    def has_document(self, doc_id: str) -> bool:
+        return doc_id in self.documents
+
+    def document_set_hash(self) -> str:
+        """Identify the set of indexed documents, independent of upload order"""
+        return hashlib.md5("\n".join(sorted(self.documents)).encode("utf-8")).hexdigest()
+
+    def add_document(self, doc_id: str, filename: str, pages: List[Dict]) -> int:
+        """Index a single document. Returns the number of chunks added."""
+        return self.add_documents([(doc_id, filename, pages)])
+
+    def add_documents(self, documents: List[tuple], prepared: Optional[Dict[str, tuple]] = None,
+                      extractors: Optional[Dict[str, str]] = None) -> int:
+        """Index (doc_id, filename, page_records) tuples.
+
+        doc_id is the PDF content hash. Documents with a stored shard are loaded
+        from disk, the rest are chunked, embedded and written to the store.
+        prepared maps doc_id to (chunks, embeddings) already computed, e.g. by a
+        PipelinedEmbedder during extraction. extractors maps doc_id to the
+        backend that extracted its pages; stored shards built from another
+        backend's text are rebuilt. All vectors are merged into the
+        FAISS index with a single add. Each document's BM25 postings are
+        likewise loaded or built and stored.
+        """
+        new_chunks = []
+        new_vectors = []
+        new_documents = {}
+        for doc_id, filename, pages in documents:
+            if doc_id in self.documents or doc_id in new_documents:
+                continue
+
+            extractor = extractors.get(doc_id) if extractors else None
+            shard = self.store.load_shard(doc_id, extractor) if self.store else None
+            if shard is not None:
+                chunks, embeddings = shard
+                # The cached chunks may carry the name the PDF was first uploaded with
+                for chunk in chunks:
+                    chunk['filename'] = filename
+            else:
+                if prepared and prepared.get(doc_id):
+                    chunks, embeddings = prepared[doc_id]
+                else:
+                    chunks = chunk_document(filename, pages)
+                    embeddings = self.embed_fn([chunk['text'] for chunk in chunks]) if chunks else None
+                if self.store and chunks:
+                    self.store.save_shard(doc_id, filename, chunks, embeddings, extractor)
+
+            new_documents[doc_id] = (len(self.chunks) + len(new_chunks), len(chunks))
+            if chunks:
+                new_chunks.extend(chunks)
+                new_vectors.append(embeddings)
+                self.sparse.add(self._sparse_shard(doc_id, chunks))
+
+        if new_vectors:
+            self._add_vectors(np.concatenate(new_vectors, axis=0))
+            self.chunks.extend(new_chunks)
+            self.alive = np.concatenate([self.alive, np.ones(len(new_chunks), dtype=bool)])
+        self.documents.update(new_documents)
+        return len(new_chunks)
+
+    def remove_document(self, doc_id: str) -> int:
+        """Remove a single document. Returns the number of chunks removed."""
+        return self.remove_documents([doc_id])
+
+    def remove_documents(self, doc_ids: List[str]) -> int:
+        """Tombstone the chunks of documents, compacting once too many chunks are dead.
+
+        Stored shards are left in place, so re-adding a document is cheap.
+        """
+        removed = 0
+        for doc_id in doc_ids:
+            if doc_id not in self.documents:
+                continue
+            start, count = self.documents.pop(doc_id)
+            self.alive[start:start + count] = False
+            removed += count
+
+        if len(self.chunks) - len(self) > COMPACT_DEAD_FRACTION * len(self.chunks):
+            self.compact()
+        return removed
+
+    def compact(self):
+        """Drop dead chunks, rebuilding the FAISS and BM25 indexes from the live ones"""
+        live_ids = np.flatnonzero(self.alive)
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)[live_ids] if len(live_ids) else None
+        sparse_shards = dict(self.sparse.shards)
+
+        chunks = []
+        documents = {}
+        self.sparse = BM25Index(self.sparse.k1, self.sparse.b)
+        # Live chunk ranges in chunk id order, the same order as live_ids
+        for doc_id, (start, count) in sorted(self.documents.items(), key=lambda item: item[1][0]):
+            documents[doc_id] = (len(chunks), count)
+            if count:
+                chunks.extend(self.chunks[start:start + count])
+                self.sparse.add(sparse_shards[start])
+
+        self.chunks = chunks
+        self.documents = documents
+        self.alive = np.ones(len(chunks), dtype=bool)
+        self.index = None
+        if vectors is not None:
+            self._add_vectors(vectors)
+
+    def _sparse_shard(self, doc_id: str, chunks: List[Dict]) -> BM25Shard:
+        shard = self.store.load_sparse_shard(doc_id) if self.store else None
+        if shard is None or len(shard) != len(chunks):
+            shard = BM25Shard.build([chunk['text'] for chunk in chunks])
+            if self.store:
+                self.store.save_sparse_shard(doc_id, shard)
+        return shard
+
+    def _add_vectors(self, embeddings: np.ndarray):
+        import faiss
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(embeddings.shape[1])
+        self.index.add(embeddings)
+
+    @traced("retrieval.search")
+    def search(self, query: str, top_k: int = DEFAULT_TOP_K, mode: str = "hybrid") -> List[Dict]:
+        """Return the top_k chunks best matching the query, best first.
+
+        mode is "hybrid" (rank fusion of dense and BM25), "dense" or "bm25".
+        Results carry the fused 'score' and the 'dense_score' / 'bm25_score'
+        of whichever retrievers found them.
+        """
+        live = len(self)
+        if self.index is None or not live:
+            return []
+        candidates = min(top_k * FUSION_CANDIDATES if mode == "hybrid" else top_k, live)
+        dead = len(self.chunks) - live
+
+        dense = {}
+        if mode in ("hybrid", "dense"):
+            query_vector = self.embed_fn([query])
+            # Over-fetch by the number of dead chunks so enough live ones remain
+            scores, ids = self.index.search(query_vector, min(candidates + dead, len(self.chunks)))
+            hits = [(int(chunk_id), float(score)) for score, chunk_id in zip(scores[0], ids[0])
+                    if chunk_id >= 0 and self.alive[chunk_id]]
+            dense = dict(hits[:candidates])
+        sparse = {}
+        if mode in ("hybrid", "bm25"):
+            sparse = dict(self.sparse.search(query, candidates, self.alive if dead else None))
+
+        if mode == "hybrid":
+            ranked = reciprocal_rank_fusion([list(dense), list(sparse)], RRF_K)
+        else:
+            ranked = list((dense or sparse).items())
+
+        results = []
+        for chunk_id, score in ranked[:top_k]:
+            result = dict(self.chunks[chunk_id])
+            result['score'] = score
+            if chunk_id in dense:
+                result['dense_score'] = dense[chunk_id]
+            if chunk_id in sparse:
+                result['bm25_score'] = sparse[chunk_id]
+            results.append(result)
+        return results
+
+
+def format_context(chunks: List[Dict]) -> str:
+    """Render retrieved chunks with their document and page citations"""
+    sections = []
+    for chunk in chunks:
+        sections.append(f"=== {chunk['filename']} (page {chunk['page']}) ===\n{chunk['text']}")
+    return "\n\n".join(sections)
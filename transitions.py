@@ -0,0 +1,136 @@
+from typing import Iterator
+
+import numpy as np
+
+TRANSITIONS = ("crossfade", "wipe", "morph")
+
+# Frames blended per NumPy call
+DEFAULT_BATCH_SIZE = 8
+
+# Width of the soft edge of a wipe, as a fraction of the frame width
+WIPE_FEATHER = 0.04
+
+# Optical flow is estimated on a downscaled copy, then upsampled
+MORPH_FLOW_SIDE = 256
+
+
+class TransitionRenderer:
+    """Render transition frames between two same-sized uint8 images.
+
+    Work buffers are allocated once per frame shape and reused, and frames are
+    blended in batches with whole-array NumPy operations. Yielded frames are
+    views into a reused output buffer: consume (write or copy) each frame
+    before requesting the next.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.shape = None
+
+    def _ensure_buffers(self, shape: tuple):
+        if self.shape == shape:
+            return
+        height, width = shape[:2]
+        self.shape = shape
+        self.start = np.empty(shape, dtype=np.float32)
+        self.delta = np.empty(shape, dtype=np.float32)
+        self.work = np.empty((self.batch_size,) + shape, dtype=np.float32)
+        self.output = np.empty((self.batch_size,) + shape, dtype=np.uint8)
+        self.columns = np.arange(width, dtype=np.float32)
+        grid_x, grid_y = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        self.grid_x, self.grid_y = grid_x, grid_y
+        self.map_x = np.empty((height, width), dtype=np.float32)
+        self.map_y = np.empty((height, width), dtype=np.float32)
+        self.warped_a = np.empty(shape, dtype=np.uint8)
+        self.warped_b = np.empty(shape, dtype=np.uint8)
+
+    def _prepare(self, a: np.ndarray, b: np.ndarray):
+        if a.shape != b.shape:
+            raise ValueError(f"Transition frames differ in shape: {a.shape} vs {b.shape}")
+        self._ensure_buffers(a.shape)
+        np.copyto(self.start, a, casting='unsafe')
+        np.subtract(b, self.start, out=self.delta, casting='unsafe')
+
+    def _blend_batches(self, weights: np.ndarray) -> Iterator[np.ndarray]:
+        """Yield start + delta * weight for each weight array in a (n, ...) stack"""
+        for offset in range(0, len(weights), self.batch_size):
+            batch = weights[offset:offset + self.batch_size]
+            count = len(batch)
+            work = self.work[:count]
+            np.multiply(self.delta, batch, out=work)
+            work += self.start
+            work += 0.5  # round instead of truncating on the cast below
+            np.copyto(self.output[:count], work, casting='unsafe')
+            for index in range(count):
+                yield self.output[index]
+
+    @staticmethod
+    def _timeline(n_frames: int) -> np.ndarray:
+        """Progress values strictly between 0 and 1 for n_frames in-between frames"""
+        return np.arange(1, n_frames + 1, dtype=np.float32) / (n_frames + 1)
+
+    def crossfade(self, a: np.ndarray, b: np.ndarray, n_frames: int) -> Iterator[np.ndarray]:
+        """Alpha blend from a to b"""
+        self._prepare(a, b)
+        alphas = self._timeline(n_frames).reshape(-1, 1, 1, 1)
+        return self._blend_batches(alphas)
+
+    def wipe(self, a: np.ndarray, b: np.ndarray, n_frames: int) -> Iterator[np.ndarray]:
+        """Left-to-right wipe from a to b with a feathered edge"""
+        self._prepare(a, b)
+        width = a.shape[1]
+        feather = max(1.0, WIPE_FEATHER * width)
+        # The edge travels from fully left of the frame to fully right of it
+        edges = self._timeline(n_frames) * (width + 2 * feather) - feather
+        masks = np.clip((edges[:, None] - self.columns[None, :]) / feather + 0.5, 0.0, 1.0)
+        return self._blend_batches(masks.reshape(n_frames, 1, width, 1))
+
+    def _estimate_flow(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Dense optical flow from a to b at full resolution"""
+        import cv2
+
+        height, width = a.shape[:2]
+        scale = min(1.0, MORPH_FLOW_SIDE / max(height, width))
+        small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        gray_a = cv2.cvtColor(cv2.resize(a, small_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        gray_b = cv2.cvtColor(cv2.resize(b, small_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        flow = cv2.calcOpticalFlowFarneback(gray_a, gray_b, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+        flow = cv2.resize(flow, (width, height), interpolation=cv2.INTER_LINEAR)
+        return flow / scale
+
+    def morph(self, a: np.ndarray, b: np.ndarray, n_frames: int) -> Iterator[np.ndarray]:
+        """Optical-flow-assisted morph: warp both images toward each other and blend"""
+        import cv2
+
+        self._prepare(a, b)
+        flow = self._estimate_flow(a, b)
+        flow_x = np.ascontiguousarray(flow[..., 0])
+        flow_y = np.ascontiguousarray(flow[..., 1])
+        frame = self.output[0]
+
+        for t in self._timeline(n_frames):
+            # Pull a forward along the flow by t and b backward by (1 - t)
+            np.multiply(flow_x, -t, out=self.map_x)
+            self.map_x += self.grid_x
+            np.multiply(flow_y, -t, out=self.map_y)
+            self.map_y += self.grid_y
+            cv2.remap(a, self.map_x, self.map_y, cv2.INTER_LINEAR, dst=self.warped_a,
+                      borderMode=cv2.BORDER_REPLICATE)
+
+            np.multiply(flow_x, 1.0 - t, out=self.map_x)
+            self.map_x += self.grid_x
+            np.multiply(flow_y, 1.0 - t, out=self.map_y)
+            self.map_y += self.grid_y
+            cv2.remap(b, self.map_x, self.map_y, cv2.INTER_LINEAR, dst=self.warped_b,
+                      borderMode=cv2.BORDER_REPLICATE)
+
+            cv2.addWeighted(self.warped_a, float(1.0 - t), self.warped_b, float(t), 0.0, dst=frame)
+            yield frame
+
+    def render(self, kind: str, a: np.ndarray, b: np.ndarray, n_frames: int) -> Iterator[np.ndarray]:
+        """Yield n_frames in-between frames of the given transition kind"""
+        if kind not in TRANSITIONS:
+            raise ValueError(f"Unknown transition '{kind}', expected one of {', '.join(TRANSITIONS)}")
+        if n_frames <= 0:
+            return iter(())
+        return getattr(self, kind)(a, b, n_frames)
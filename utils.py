@@ -1,18 +1,235 @@
-from openai import OpenAI
 import os
+import random
+import time
+from collections import deque
+from functools import lru_cache
 from dotenv import load_dotenv
+from instrumentation import increment, record_usage, span
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def get_openai_response(prompt, chat_history=None):
-    message = chat_history if chat_history else []
-    message.append({"role":"user", "content":prompt})
+# Connection pool and timeouts (seconds) shared by every OpenAI request in the process.
+# openai is imported on first use: it takes ~0.5s to import.
+HTTP_POOL_LIMITS = {'max_connections': 64, 'max_keepalive_connections': 32, 'keepalive_expiry': 120}
+HTTP_TIMEOUT = {'timeout': 120.0, 'connect': 10.0}
+
+# Timings of the most recent chat requests in this process
+chat_timings = deque(maxlen=200)
+
+
+@lru_cache(maxsize=None)
+def retryable_errors():
+    """Errors worth retrying with backoff (rate limits, overload, transient network issues)"""
+    import openai
+    return (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def _count_response(response):
+    increment("openai_http_responses_total", str(response.status_code), label_name="status")
 
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages= message
+
+@lru_cache(maxsize=None)
+def _client_for_key(api_key):
+    import openai
+
+    # Built from openai's own types, which come from whichever HTTP library this openai release uses
+    limits = type(openai.DEFAULT_CONNECTION_LIMITS)(**HTTP_POOL_LIMITS)
+    http_client = openai.DefaultHttpxClient(
+        limits=limits, timeout=openai.Timeout(**HTTP_TIMEOUT),
+        # Counts every HTTP response, including the client's own retries of 429s and 5xxs
+        event_hooks={'response': [_count_response]}
     )
-    reply = response.choices[0].message.content
+    return openai.OpenAI(api_key=api_key, http_client=http_client, max_retries=2)
+
+
+def get_openai_client(api_key=None):
+    """Return the process-wide OpenAI client for an API key (defaults to OPENAI_API_KEY).
+
+    Clients are created once per key and keep their HTTP connections alive,
+    so warm requests skip TLS and connection setup.
+    """
+    return _client_for_key(api_key or os.getenv("OPENAI_API_KEY"))
+
+
+class ChatStream:
+    """Iterator over the text deltas of a streamed chat completion.
+
+    Once iterated, `content` holds the full reply and `time_to_first_token`
+    and `total_time` the request timings in seconds.
+    """
+
+    def __init__(self, messages, model="gpt-4", chat_client=None, **params):
+        self.messages = messages
+        self.model = model
+        self.chat_client = chat_client or get_openai_client()
+        self.params = params
+        self.content = ""
+        self.time_to_first_token = None
+        self.total_time = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        with span("openai.chat", model=self.model, messages=len(self.messages)) as attributes:
+            # The final chunk then carries the token usage of the whole request
+            params = {'stream_options': {'include_usage': True}, **self.params}
+            response = self.chat_client.chat.completions.create(
+                model=self.model,
+                messages=self.messages,
+                stream=True,
+                **params
+            )
+            parts = []
+            for chunk in response:
+                if getattr(chunk, "usage", None):
+                    record_usage(attributes, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.perf_counter() - start
+                        attributes['time_to_first_token'] = self.time_to_first_token
+                    parts.append(delta)
+                    yield delta
+            self.content = "".join(parts)
+            self.total_time = time.perf_counter() - start
+
+    def stats(self):
+        return {
+            "model": self.model,
+            "time_to_first_token": self.time_to_first_token,
+            "total_time": self.total_time
+        }
+
+
+def _retryable_cause(error, retry_on=()):
+    """Return the retryable error behind an exception, if any"""
+    retryable = retryable_errors() + tuple(retry_on)
+    while error is not None:
+        if isinstance(error, retryable):
+            return error
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def _retry_after(error):
+    """Seconds the server asked us to wait, from the Retry-After headers"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        if "retry-after" in response.headers:
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def call_with_backoff(fn, *args, max_retries=5, base_delay=1.0, max_delay=60.0, retry_on=(), **kwargs):
+    """Call fn, retrying rate-limit and transient API errors with exponential backoff.
+
+    The server's Retry-After hint is honoured when present, otherwise the delay
+    doubles on every attempt with full jitter so concurrent callers spread out.
+    Errors are also retried when they were re-raised wrapped in another exception.
+    retry_on adds exception types to retry besides the OpenAI ones.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            cause = _retryable_cause(e, retry_on)
+            if cause is None or attempt == max_retries:
+                raise
+            increment("retries_total", getattr(fn, "__name__", "call"), label_name="function")
+            delay = _retry_after(cause)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            time.sleep(min(delay, max_delay))
+
+
+class CachedReply:
+    """Stand-in for ChatStream when a reply is served from a cache"""
+
+    def __init__(self, content, lookup_time=0.0):
+        self.content = content
+        self.lookup_time = lookup_time
+
+    def __iter__(self):
+        yield self.content
+
+    def stats(self):
+        return {
+            "model": "cache",
+            "cached": True,
+            "time_to_first_token": self.lookup_time,
+            "total_time": self.lookup_time
+        }
+
+
+def replay_reply(content, render=None, lookup_time=0.0):
+    """Show a cached reply through the same render callback as a streamed one"""
+    reply = CachedReply(content, lookup_time)
+    if render:
+        render(reply)
+    return reply.content, reply.stats()
+
+
+def complete_chat(messages, model="gpt-4", render=None, chat_client=None, **params):
+    """Run a streamed chat completion and return (reply, stats).
+
+    render receives the delta iterator and is expected to consume it while
+    displaying it, e.g. st.write_stream inside st.chat_message.
+    """
+    stream = ChatStream(messages, model=model, chat_client=chat_client, **params)
+    if render:
+        render(stream)
+    else:
+        for _ in stream:
+            pass
+    stats = stream.stats()
+    chat_timings.append(stats)
+    return stream.content, stats
+
+
+def streamlit_renderer(stats_key="last_chat_stats"):
+    """Render callback that writes deltas with st.write_stream and keeps the timings in session state"""
+    import streamlit as st
+
+    def render(stream):
+        st.write_stream(stream)
+        st.session_state[stats_key] = stream.stats()
+    return render
+
+
+def format_chat_stats(stats):
+    """One-line summary of a request's timings"""
+    if not stats or stats.get("time_to_first_token") is None:
+        return ""
+    if stats.get("cached"):
+        return f"⚡ Answered from cache in {stats['total_time']:.2f}s"
+    return f"⏱️ First token in {stats['time_to_first_token']:.2f}s, full reply in {stats['total_time']:.2f}s"
+
+
+def get_openai_response(prompt, chat_history=None, render=None, history_manager=None):
+    message = chat_history if chat_history else []
+    user_message = {"role":"user", "content":prompt}
+
+    # With a history manager only the budgeted window (plus its summary) is sent
+    if history_manager is not None:
+        history_manager.append("user", prompt)
+    try:
+        request_messages = history_manager.messages() if history_manager is not None else message + [user_message]
+        reply, _ = complete_chat(request_messages, model="gpt-4", render=render)
+    except Exception:
+        # A failed turn is not kept, or the next request would send two user messages in a row
+        if history_manager is not None:
+            history_manager.pop()
+        raise
+
+    message.append(user_message)
     message.append({"role":"assistant", "content": reply})
-    return reply, message
\ No newline at end of file
+    if history_manager is not None:
+        history_manager.append("assistant", reply)
+    return reply, message
@@ -1,6 +1,6 @@
-import os
-from openai import OpenAI
 from dotenv import load_dotenv
+from utils import get_openai_client
+from instrumentation import record_usage, span
 
 # Load environment variables
 load_dotenv()
@@ -16,8 +16,8 @@ def get_openai_response(user_input, chat_history):
     Returns:
         tuple: (response_content, updated_chat_history)
     """
-    # Initialize OpenAI client
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    # Shared OpenAI client with pooled connections
+    client = get_openai_client()
     
     # Create messages for API call
     messages = []
@@ -37,12 +37,14 @@ def get_openai_response(user_input, chat_history):
     
     try:
         # Make API call to OpenAI
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.7
-        )
+        with span("openai.chat", model="gpt-3.5-turbo") as attributes:
+            response = client.chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=messages,
+                max_tokens=1000,
+                temperature=0.7
+            )
+            record_usage(attributes, response.usage)
         
         # Extract response content
         response_content = response.choices[0].message.content
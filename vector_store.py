@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from bm25 import BM25Shard
+
+MANIFEST_VERSION = 1
+
+
+class VectorShardStore:
+    """Per-document embedding shards stored next to the PDF text cache.
+
+    Each document hash gets a ``<hash>.npy`` matrix of float32 embeddings, a
+    ``<hash>.chunks.json`` file with the chunk metadata and a ``<hash>.bm25.npz``
+    file with its BM25 postings. ``manifest.json`` lists
+    the shards and the embedding settings they were built with; shards built
+    with different settings, or from text of another extraction backend, are
+    ignored and rebuilt. One instance can be shared
+    by concurrent sessions.
+    """
+
+    def __init__(self, cache_dir: str = "pdf_cache", signature: Optional[Dict] = None):
+        self.shard_dir = os.path.join(cache_dir, "vectors")
+        os.makedirs(self.shard_dir, exist_ok=True)
+        self.manifest_path = os.path.join(self.shard_dir, "manifest.json")
+        self.signature = signature or {}
+        self._lock = threading.Lock()
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> Dict:
+        empty = {'version': MANIFEST_VERSION, 'signature': self.signature, 'shards': {}}
+        if not os.path.exists(self.manifest_path):
+            return empty
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return empty
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('signature') != self.signature:
+            # Embedding settings changed, the stored vectors are no longer comparable
+            return empty
+        return manifest
+
+    def _write_manifest(self):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _paths(self, file_hash: str) -> tuple:
+        base = os.path.join(self.shard_dir, file_hash)
+        return f"{base}.npy", f"{base}.chunks.json"
+
+    def _sparse_path(self, file_hash: str) -> str:
+        return os.path.join(self.shard_dir, f"{file_hash}.bm25.npz")
+
+    def has_shard(self, file_hash: str, extractor: Optional[str] = None) -> bool:
+        """Whether a shard is stored, and was built from text extracted by extractor when given"""
+        entry = self.manifest['shards'].get(file_hash)
+        if entry is None or (extractor and entry.get('extractor') != extractor):
+            return False
+        return all(os.path.exists(path) for path in self._paths(file_hash))
+
+    def save_shard(self, file_hash: str, filename: str, chunks: List[Dict], embeddings: np.ndarray,
+                   extractor: Optional[str] = None):
+        """Persist the chunks and embeddings of one document"""
+        vectors_path, chunks_path = self._paths(file_hash)
+        np.save(vectors_path, np.ascontiguousarray(embeddings, dtype=np.float32))
+        with open(chunks_path, 'w', encoding='utf-8') as f:
+            json.dump(chunks, f)
+        # Postings built from the previous chunks no longer match
+        if os.path.exists(self._sparse_path(file_hash)):
+            os.remove(self._sparse_path(file_hash))
+
+        with self._lock:
+            # Another process may have added shards since we loaded the manifest
+            self.manifest = self._load_manifest()
+            self.manifest['shards'][file_hash] = {
+                'filename': filename,
+                'chunks': len(chunks),
+                'dim': int(embeddings.shape[1]) if len(chunks) else 0,
+                'extractor': extractor,
+                'created': time.time()
+            }
+            self._write_manifest()
+
+    def load_shard(self, file_hash: str, extractor: Optional[str] = None) -> Optional[tuple]:
+        """Return (chunks, embeddings) for a document, with the embeddings memory-mapped"""
+        if not self.has_shard(file_hash, extractor):
+            return None
+        vectors_path, chunks_path = self._paths(file_hash)
+        try:
+            with open(chunks_path, 'r', encoding='utf-8') as f:
+                chunks = json.load(f)
+            embeddings = np.load(vectors_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        return chunks, embeddings
+
+    def save_sparse_shard(self, file_hash: str, shard: BM25Shard):
+        """Persist the BM25 postings of one document"""
+        shard.save(self._sparse_path(file_hash))
+
+    def load_sparse_shard(self, file_hash: str) -> Optional[BM25Shard]:
+        """Return a document's BM25 postings, or None if missing or built by another version"""
+        path = self._sparse_path(file_hash)
+        if not os.path.exists(path):
+            return None
+        return BM25Shard.load(path)
+
+    def remove_shard(self, file_hash: str):
+        for path in self._paths(file_hash) + (self._sparse_path(file_hash),):
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self.manifest = self._load_manifest()
+            if self.manifest['shards'].pop(file_hash, None) is not None:
+                self._write_manifest()